@@ -1,7 +1,8 @@
 from django.contrib import admin
+from .attendance_summary import refresh_daily_summaries
 from .models import (
     Department, Position, PositionLevel, EmployeeProfile,
-    EmployeeFaceData, Attendance, AttendanceLog,
+    EmployeeFaceData, EmployeeFaceTemplate, CompanyFaceSettings, FaceVerificationJob, FaceEnrollmentJob, IdempotencyKey, Attendance, AttendanceDailySummary, AttendanceLog,
     EmployeeLocation, EmployeeScreenshot,
     Shift, ShiftAssignment, UserShift  # Added these models
 )
@@ -60,6 +61,41 @@ class EmployeeFaceDataAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(EmployeeFaceTemplate)
+class EmployeeFaceTemplateAdmin(admin.ModelAdmin):
+    list_display = ('employee', 'label', 'created_at')
+    search_fields = ('employee__full_name', 'label')
+    readonly_fields = ('created_at',)
+
+@admin.register(CompanyFaceSettings)
+class CompanyFaceSettingsAdmin(admin.ModelAdmin):
+    list_display = ('company', 'detection_model', 'upsample_times', 'num_jitters', 'detection_max_edge',
+                   'quality_check_enabled', 'min_face_size', 'async_verification', 'updated_at')
+    list_filter = ('detection_model', 'quality_check_enabled', 'async_verification')
+    search_fields = ('company__name',)
+    readonly_fields = ('created_at', 'updated_at')
+
+@admin.register(FaceVerificationJob)
+class FaceVerificationJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'employee', 'attendance', 'status', 'face_confidence', 'attempts', 'created_at', 'completed_at')
+    list_filter = ('status',)
+    search_fields = ('employee__full_name', 'message')
+    readonly_fields = ('created_at', 'started_at', 'completed_at')
+
+@admin.register(FaceEnrollmentJob)
+class FaceEnrollmentJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'company', 'created_by', 'status', 'created_at', 'completed_at')
+    list_filter = ('status',)
+    search_fields = ('company__name', 'message')
+    readonly_fields = ('summary', 'results', 'created_at', 'started_at', 'completed_at')
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ('key', 'endpoint', 'user', 'status_code', 'created_at', 'expires_at')
+    list_filter = ('endpoint', 'status_code')
+    search_fields = ('key', 'user__username')
+    readonly_fields = ('created_at',)
+
 @admin.register(Attendance)
 class AttendanceAdmin(admin.ModelAdmin):
     list_display = ('employee', 'date', 'status', 'shift_name', 'check_in_time', 'check_out_time', 
@@ -86,7 +122,7 @@ class AttendanceAdmin(admin.ModelAdmin):
             'fields': ('duration_display',)
         }),
         ('Verification', {
-            'fields': ('is_face_verified', 'is_location_verified', 'is_blink_verified', 'face_image')
+            'fields': ('is_face_verified', 'face_confidence', 'face_verification_status', 'is_location_verified', 'is_blink_verified', 'face_image')
         }),
         ('Additional Information', {
             'fields': ('device_info', 'created_at', 'updated_at')
@@ -125,9 +161,27 @@ class AttendanceAdmin(admin.ModelAdmin):
     
     duration_display.short_description = 'Duration'
     
+    def _refresh_summaries(self, queryset):
+        """Admin edits bypass the attendance views, so bring the daily summaries back in step"""
+        refresh_daily_summaries(set(queryset.values_list('employee_id', 'date')))
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        refresh_daily_summaries({(obj.employee_id, obj.date)})
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_daily_summaries({(obj.employee_id, obj.date)})
+    
+    def delete_queryset(self, request, queryset):
+        days = set(queryset.values_list('employee_id', 'date'))
+        super().delete_queryset(request, queryset)
+        refresh_daily_summaries(days)
+    
     def mark_as_present(self, request, queryset):
         """Mark selected attendance records as present"""
         queryset.update(status='present')
+        self._refresh_summaries(queryset)
         self.message_user(request, f"{queryset.count()} attendance records marked as present.")
     
     mark_as_present.short_description = "Mark selected records as present"
@@ -135,6 +189,7 @@ class AttendanceAdmin(admin.ModelAdmin):
     def mark_as_absent(self, request, queryset):
         """Mark selected attendance records as absent"""
         queryset.update(status='absent')
+        self._refresh_summaries(queryset)
         self.message_user(request, f"{queryset.count()} attendance records marked as absent.")
     
     mark_as_absent.short_description = "Mark selected records as absent"
@@ -142,6 +197,7 @@ class AttendanceAdmin(admin.ModelAdmin):
     def mark_as_late(self, request, queryset):
         """Mark selected attendance records as late"""
         queryset.update(status='late')
+        self._refresh_summaries(queryset)
         self.message_user(request, f"{queryset.count()} attendance records marked as late.")
     
     mark_as_late.short_description = "Mark selected records as late"
@@ -149,10 +205,20 @@ class AttendanceAdmin(admin.ModelAdmin):
     def mark_as_leave(self, request, queryset):
         """Mark selected attendance records as on leave"""
         queryset.update(status='leave')
+        self._refresh_summaries(queryset)
         self.message_user(request, f"{queryset.count()} attendance records marked as on leave.")
     
     mark_as_leave.short_description = "Mark selected records as on leave"
 
+@admin.register(AttendanceDailySummary)
+class AttendanceDailySummaryAdmin(admin.ModelAdmin):
+    list_display = ('employee', 'date', 'status', 'first_check_in', 'last_check_out', 'total_minutes',
+                   'record_count', 'late_minutes', 'updated_at')
+    list_filter = ('date', 'status', 'company')
+    search_fields = ('employee__full_name', 'employee__user__username')
+    date_hierarchy = 'date'
+    readonly_fields = ('updated_at',)
+
 @admin.register(AttendanceLog)
 class AttendanceLogAdmin(admin.ModelAdmin):
     list_display = ('employee', 'timestamp', 'face_verification_result', 'location_verification_result', 'blink_verification_result')
@@ -1,6 +1,25 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class EmployeesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'employees'
+
+    def ready(self):
+        import employees.signals  # geofence grid invalidation
+
+        # Opt-in (FACE_PRELOAD_MODELS) for processes that serve face requests: load the dlib
+        # models at boot instead of on the first punch after a deploy or worker recycle.
+        if not getattr(settings, 'FACE_PRELOAD_MODELS', False):
+            return
+        # Skip management commands (migrate, shell, ...) and the runserver autoreload parent
+        if 'manage.py' in os.path.basename(sys.argv[0]) and 'runserver' not in sys.argv:
+            return
+        if 'runserver' in sys.argv and os.environ.get('RUN_MAIN') != 'true':
+            return
+        from .face_worker import start_face_warmup
+        start_face_warmup()
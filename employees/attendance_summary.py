@@ -0,0 +1,156 @@
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Attendance, AttendanceDailySummary
+
+SUMMARY_FIELDS = (
+    'first_check_in', 'last_check_out', 'total_minutes', 'record_count',
+    'punch_count', 'open_sessions', 'status', 'late_minutes',
+)
+
+
+def _late_minutes(record):
+    """Minutes between the shift start and a late check-in (the shift must be loaded)"""
+    if record.status != 'late' or not record.shift_id or not record.check_in_time:
+        return None
+    shift_start = timezone.make_aware(datetime.combine(record.date, record.shift.start_time))
+    return max(int((record.check_in_time - shift_start).total_seconds() / 60), 0)
+
+
+def summarize_day(records):
+    """Summary fields of one employee's Attendance records of one day"""
+    check_ins = [r.check_in_time for r in records if r.check_in_time]
+    check_outs = [r.check_out_time for r in records if r.check_out_time]
+    first = min(records, key=lambda r: r.check_in_time or timezone.now())
+    return {
+        'first_check_in': min(check_ins) if check_ins else None,
+        'last_check_out': max(check_outs) if check_outs else None,
+        'total_minutes': sum(max(r.duration_minutes() or 0, 0) for r in records),
+        'record_count': len(records),
+        'punch_count': len(check_ins) + len(check_outs),
+        'open_sessions': sum(1 for r in records if r.check_in_time and not r.check_out_time),
+        'status': first.status,
+        'late_minutes': _late_minutes(first),
+    }
+
+
+def refresh_daily_summaries(keys, records=None):
+    """
+    Recompute the summaries of the given (employee_id, date) days.
+    `records` may carry the days' Attendance rows already in memory (with their shift loaded);
+    otherwise they are read in one query. Call it in the transaction that wrote the attendance,
+    holding the employee's row lock where two requests could create the same day.
+    """
+    keys = set(keys)
+    if not keys:
+        return
+    employee_ids = {employee_id for employee_id, _ in keys}
+    dates = {date for _, date in keys}
+    if records is None:
+        records = Attendance.objects.filter(
+            employee_id__in=employee_ids, date__in=dates
+        ).select_related('shift').order_by()
+
+    days, companies = {}, {}
+    for record in records:
+        key = (record.employee_id, record.date)
+        if key in keys:
+            days.setdefault(key, []).append(record)
+            companies[key] = record.company_id
+
+    existing = {
+        (summary.employee_id, summary.date): summary
+        for summary in AttendanceDailySummary.objects.filter(employee_id__in=employee_ids, date__in=dates)
+    }
+    now = timezone.now()
+    to_create, to_update, to_delete = [], [], []
+    for key in keys:
+        summary = existing.get(key)
+        if key not in days:
+            if summary:
+                to_delete.append(summary.id)
+            continue
+        fields = summarize_day(days[key])
+        if summary is None:
+            to_create.append(AttendanceDailySummary(
+                employee_id=key[0], date=key[1], company_id=companies[key], **fields
+            ))
+        elif any(getattr(summary, name) != value for name, value in fields.items()):
+            for name, value in fields.items():
+                setattr(summary, name, value)
+            summary.updated_at = now
+            to_update.append(summary)
+
+    if to_create:
+        AttendanceDailySummary.objects.bulk_create(to_create)
+    if to_update:
+        AttendanceDailySummary.objects.bulk_update(to_update, [*SUMMARY_FIELDS, 'updated_at'])
+    if to_delete:
+        AttendanceDailySummary.objects.filter(id__in=to_delete).delete()
+
+
+def rebuild_daily_summaries(company_id=None, start_date=None, end_date=None, batch_size=1000, employees_per_chunk=100):
+    """
+    Recompute every summary in a range from the raw Attendance rows (backfill / repair).
+    Employees are rebuilt a chunk at a time, each chunk in its own transaction holding their
+    EmployeeProfile row locks (as punches do), so a live punch waits for its own chunk at most
+    and never sees the range half deleted.
+    """
+    from .models import EmployeeProfile
+
+    def in_range(queryset):
+        if company_id:
+            queryset = queryset.filter(company_id=company_id)
+        if start_date:
+            queryset = queryset.filter(date__gte=start_date)
+        if end_date:
+            queryset = queryset.filter(date__lte=end_date)
+        return queryset
+
+    attendance = in_range(Attendance.objects.select_related('shift')).order_by('employee_id', 'date')
+    summaries = in_range(AttendanceDailySummary.objects.all())
+    employee_ids = sorted(
+        set(in_range(Attendance.objects.all()).values_list('employee_id', flat=True).distinct())
+        | set(summaries.values_list('employee_id', flat=True).distinct())
+    )
+
+    created = 0
+    for start in range(0, len(employee_ids), employees_per_chunk):
+        chunk = employee_ids[start:start + employees_per_chunk]
+        with transaction.atomic():
+            list(EmployeeProfile.objects.select_for_update().filter(id__in=chunk).order_by('id').values_list('id', flat=True))
+            summaries.filter(employee_id__in=chunk).delete()
+            batch, day = [], []
+            for record in attendance.filter(employee_id__in=chunk).iterator(chunk_size=2000):
+                if day and (record.employee_id, record.date) != (day[0].employee_id, day[0].date):
+                    batch.append(_summary_of(day))
+                    day = []
+                day.append(record)
+            if day:
+                batch.append(_summary_of(day))
+            AttendanceDailySummary.objects.bulk_create(batch, batch_size=batch_size)
+            created += len(batch)
+    return created
+
+
+def _summary_of(day):
+    first = day[0]
+    return AttendanceDailySummary(
+        employee_id=first.employee_id, date=first.date, company_id=first.company_id, **summarize_day(day)
+    )
+
+
+def summary_to_dict(summary):
+    return {
+        'date': summary.date.isoformat(),
+        'first_check_in': summary.first_check_in.isoformat() if summary.first_check_in else None,
+        'last_check_out': summary.last_check_out.isoformat() if summary.last_check_out else None,
+        'total_minutes': summary.total_minutes,
+        'record_count': summary.record_count,
+        'punch_count': summary.punch_count,
+        'open_sessions': summary.open_sessions,
+        'status': summary.status,
+        'late_minutes': summary.late_minutes,
+    }
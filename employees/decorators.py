@@ -499,4 +499,133 @@ def position_level_access_control(action_type):
         
         return wrapped_view
     
-    return decorator
\ No newline at end of file
+    return decorator
+
+def request_body_limit(setting_name, default):
+    """
+    Decorator for endpoints whose JSON body can legitimately exceed DATA_UPLOAD_MAX_MEMORY_SIZE
+    (e.g. a batch of offline punches with face images).
+    
+    Reads the body up front against the limit in `setting_name` instead of the global one and
+    answers 413 when it is larger, so request.body never raises RequestDataTooBig further down.
+    Place it directly below @api_view / @permission_classes, above @idempotent_request.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            from io import BytesIO
+            from django.conf import settings
+            
+            max_size = getattr(settings, setting_name, default)
+            http_request = getattr(request, '_request', request)
+            too_large = JsonResponse({
+                'success': False,
+                'message': f'Request body is larger than the {max_size} byte limit'
+            }, status=413)
+            
+            if not hasattr(http_request, '_body'):
+                try:
+                    content_length = int(http_request.META.get('CONTENT_LENGTH') or 0)
+                except ValueError:
+                    content_length = 0
+                if content_length > max_size:
+                    return too_large
+                body = http_request.read(max_size + 1)
+                if len(body) > max_size:
+                    return too_large
+                http_request._body = body
+                http_request._stream = BytesIO(body)
+            elif len(http_request._body) > max_size:
+                return too_large
+            
+            return view_func(request, *args, **kwargs)
+        
+        return wrapped_view
+    
+    return decorator
+
+def idempotent_request(endpoint):
+    """
+    Decorator for POST endpoints that mobile clients retry (e.g. mark_attendance).
+    
+    When the request carries an `Idempotency-Key` header, the first response for that
+    (user, endpoint, key) is stored in IdempotencyKey and replayed to every retry until
+    IDEMPOTENCY_KEY_TTL expires, without running the view again. Server errors (5xx,
+    including a busy face worker) are not stored, so those can be retried with the same key.
+    Requests without the header are passed through untouched.
+    
+    Place it below @api_view so request.user is the authenticated user.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            import hashlib
+            from datetime import timedelta
+            from django.conf import settings
+            from django.db import IntegrityError
+            from django.db.models import Q
+            from django.http import HttpResponse
+            from django.utils import timezone
+            from .models import IdempotencyKey
+            
+            key = request.headers.get('Idempotency-Key')
+            if not key or not request.user.is_authenticated:
+                return view_func(request, *args, **kwargs)
+            if len(key) > 255:
+                return JsonResponse({'success': False, 'message': 'Idempotency-Key is too long'}, status=400)
+            
+            now = timezone.now()
+            request_hash = hashlib.sha256(request.body).hexdigest()
+            lookup = {'user_id': request.user.id, 'endpoint': endpoint, 'key': key}
+            
+            # Expired keys, and placeholders left behind by a worker that died mid-request, are reusable
+            stale_before = now - timedelta(seconds=getattr(settings, 'IDEMPOTENCY_IN_PROGRESS_TIMEOUT', 120))
+            IdempotencyKey.objects.filter(
+                Q(expires_at__lte=now) | Q(status_code__isnull=True, created_at__lt=stale_before), **lookup
+            ).delete()
+            
+            try:
+                record = IdempotencyKey.objects.create(
+                    **lookup,
+                    request_hash=request_hash,
+                    expires_at=now + timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400)),
+                )
+            except IntegrityError:
+                record = IdempotencyKey.objects.filter(**lookup).first()
+                if record is None:
+                    return JsonResponse({'success': False, 'message': 'Please retry the request'}, status=409)
+                if record.request_hash != request_hash:
+                    return JsonResponse({
+                        'success': False,
+                        'message': 'Idempotency-Key was already used for a different request'
+                    }, status=422)
+                if record.status_code is None:
+                    return JsonResponse({
+                        'success': False,
+                        'message': 'A request with this Idempotency-Key is still being processed'
+                    }, status=409)
+                logger.info(f"Replaying {endpoint} response for idempotency key {key}")
+                response = HttpResponse(
+                    record.response_body, status=record.status_code, content_type='application/json'
+                )
+                response['Idempotent-Replayed'] = 'true'
+                return response
+            
+            try:
+                response = view_func(request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+            
+            if response.status_code >= 500:
+                record.delete()
+            else:
+                IdempotencyKey.objects.filter(id=record.id).update(
+                    status_code=response.status_code,
+                    response_body=response.content.decode('utf-8'),
+                )
+            return response
+        
+        return wrapped_view
+    
+    return decorator
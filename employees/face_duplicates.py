@@ -0,0 +1,89 @@
+import numpy as np
+
+from .face_index import get_company_index
+from .face_utils import ENCODING_DTYPE, ENCODING_SIZE, FACE_MATCH_TOLERANCE, bytes_to_encoding, usable_encoding_versions
+
+
+def _company_matrix(company_id, include_templates=False):
+    """
+    (N, 128) matrix of a company's encodings and the employee id owning each row.
+    Like the index, only rows of a usable encoding version: distances across versions mean nothing.
+    """
+    index = get_company_index(company_id)
+    with index.lock:
+        matrix, employee_ids = index.matrix, index.employee_ids
+    if not include_templates:
+        return matrix, employee_ids
+
+    from .models import EmployeeFaceTemplate
+
+    vectors, owners = [], []
+    blobs = EmployeeFaceTemplate.objects.filter(
+        employee__company_id=company_id, encoding_version__in=usable_encoding_versions()
+    ).values_list('employee_id', 'face_encoding_binary')
+    for employee_id, raw in blobs.iterator(chunk_size=2000):
+        try:
+            vectors.append(bytes_to_encoding(raw))
+        except ValueError:
+            continue
+        owners.append(employee_id)
+    if not vectors:
+        return matrix, employee_ids
+    return (
+        np.ascontiguousarray(np.vstack([matrix, np.vstack(vectors)]), dtype=ENCODING_DTYPE),
+        np.concatenate([employee_ids, np.asarray(owners, dtype=np.int64)]),
+    )
+
+
+def _block_pairs(matrix, employee_ids, threshold, block_size):
+    """
+    Yield (employee_a, employee_b, distance) arrays for every pair of rows closer than threshold.
+    Distances come from ||a||^2 + ||b||^2 - 2ab computed one (block x block) tile at a time,
+    so peak memory is block_size^2 floats whatever the number of rows.
+    """
+    count = len(matrix)
+    squared_norms = np.einsum('ij,ij->i', matrix, matrix)
+    limit = threshold * threshold
+    for start_a in range(0, count, block_size):
+        block_a = matrix[start_a:start_a + block_size]
+        norms_a = squared_norms[start_a:start_a + block_size, None]
+        for start_b in range(start_a, count, block_size):
+            block_b = matrix[start_b:start_b + block_size]
+            squared = norms_a + squared_norms[None, start_b:start_b + block_size] - 2.0 * (block_a @ block_b.T)
+            if start_a == start_b:
+                # Same tile: only the upper triangle, without a row against itself
+                squared[np.tril_indices_from(squared)] = np.inf
+            rows, cols = np.nonzero(squared <= limit)
+            if not len(rows):
+                continue
+            ids_a = employee_ids[start_a + rows]
+            ids_b = employee_ids[start_b + cols]
+            different = ids_a != ids_b
+            if not different.any():
+                continue
+            distances = np.sqrt(np.maximum(squared[rows, cols], 0.0))
+            yield ids_a[different], ids_b[different], distances[different]
+
+
+def find_duplicate_faces(company_id, threshold=FACE_MATCH_TOLERANCE, block_size=2048, include_templates=False):
+    """
+    Pairs of different employees of a company whose enrolled faces are within `threshold`.
+    Returns [{'employee_a', 'employee_b', 'distance'}] sorted by distance, one entry per pair.
+    """
+    matrix, employee_ids = _company_matrix(company_id, include_templates)
+    if len(matrix) < 2:
+        return []
+    matrix = np.ascontiguousarray(matrix, dtype=ENCODING_DTYPE).reshape(-1, ENCODING_SIZE)
+
+    closest = {}  # (low id, high id) -> smallest distance over all their templates
+    for ids_a, ids_b, distances in _block_pairs(matrix, employee_ids, threshold, block_size):
+        low, high = np.minimum(ids_a, ids_b), np.maximum(ids_a, ids_b)
+        for pair_a, pair_b, distance in zip(low.tolist(), high.tolist(), distances.tolist()):
+            key = (pair_a, pair_b)
+            if key not in closest or distance < closest[key]:
+                closest[key] = distance
+
+    return sorted(
+        ({'employee_a': a, 'employee_b': b, 'distance': round(d, 4)} for (a, b), d in closest.items()),
+        key=lambda pair: pair['distance']
+    )
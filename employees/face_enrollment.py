@@ -0,0 +1,313 @@
+import logging
+import os
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .face_utils import FaceQualityError, encode_image_bytes
+from .face_worker import create_batch_pool
+from .models import CompanyFaceSettings, EmployeeFaceData, EmployeeProfile, FaceEnrollmentJob, face_image_path
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.webp'}
+MAX_MEMBER_SIZE = 15 * 1024 * 1024  # bytes, per uncompressed photo
+
+
+def _archive_members(zip_file):
+    """Image entries of the archive, skipping folders and OS metadata"""
+    for info in zip_file.infolist():
+        if info.is_dir():
+            continue
+        name = info.filename.replace('\\', '/')
+        base = os.path.basename(name)
+        if not base or base.startswith('.') or '__MACOSX/' in name:
+            continue
+        stem, ext = os.path.splitext(base)
+        if ext.lower() not in IMAGE_EXTENSIONS:
+            continue
+        yield info, stem.strip(), ext.lower()
+
+
+def _resolve_employees(company, identifiers):
+    """Map file stems (username or employee id) to EmployeeProfile rows in one query"""
+    numeric_ids = [int(i) for i in identifiers if i.isdigit()]
+    employees = EmployeeProfile.objects.filter(company=company).filter(
+        Q(user__username__in=identifiers) | Q(id__in=numeric_ids)
+    ).select_related('user')
+    by_username = {e.user.username.lower(): e for e in employees}
+    by_id = {str(e.id): e for e in employees}
+    return lambda identifier: by_username.get(identifier.lower()) or by_id.get(identifier)
+
+
+def _flush(batch):
+    """Create or update EmployeeFaceData for a batch of successful encodings"""
+    if not batch:
+        return
+    now = timezone.now()
+    existing = {
+        fd.employee_id: fd
+        for fd in EmployeeFaceData.objects.filter(employee_id__in=[item['employee'].id for item in batch])
+    }
+    to_create, to_update = [], []
+    saved_names, replaced_names = [], []
+    try:
+        for item in batch:
+            employee = item['employee']
+            image_name = default_storage.save(
+                face_image_path(None, f"face_{employee.id}{item['ext']}"),
+                ContentFile(item['raw_bytes'])
+            )
+            saved_names.append(image_name)
+            face_data = existing.get(employee.id)
+            if face_data is None:
+                face_data = EmployeeFaceData(employee=employee, allowed_radius=100)
+                to_create.append(face_data)
+            else:
+                if face_data.face_image:
+                    replaced_names.append(face_data.face_image.name)
+                to_update.append(face_data)
+            face_data.face_image = image_name
+            face_data.set_encoding(item['encoding'])
+            face_data.updated_at = now
+
+        with transaction.atomic():
+            if to_create:
+                EmployeeFaceData.objects.bulk_create(to_create, batch_size=len(to_create))
+            if to_update:
+                EmployeeFaceData.objects.bulk_update(
+                    to_update,
+                    ['face_image', 'face_encoding', 'face_encoding_binary', 'encoding_version', 'updated_at'],
+                    batch_size=len(to_update)
+                )
+            # Previous photos are only dropped once the rows no longer point at them
+            transaction.on_commit(lambda: _delete_files(replaced_names))
+    except Exception:
+        # No row points at this batch's new files
+        _delete_files(saved_names)
+        raise
+
+
+def _delete_files(names):
+    for name in names:
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.warning(f"Could not delete face image {name}")
+
+
+def bulk_enroll_from_zip(archive, company, face_options, quality_options=None, batch_size=100, max_workers=None,
+                         pool=None):
+    """
+    Enroll faces from a ZIP of photos named `<username or employee id>.<ext>`.
+    Members are read one at a time, quality-checked and encoded across a process pool
+    (`pool`, or a new one of `max_workers` processes) and written in batches.
+    Returns a per-file report.
+    """
+    report = []
+    ready = []
+    seen_employees = set()
+
+    with zipfile.ZipFile(archive) as zip_file:
+        members = list(_archive_members(zip_file))
+        find_employee = _resolve_employees(company, [stem for _, stem, _ in members])
+
+        owned_pool = pool is None
+        if owned_pool:
+            pool = create_batch_pool(max_workers)
+        try:
+            max_in_flight = (max_workers or os.cpu_count() or 1) * 2
+            pending = {}
+
+            def collect(done):
+                for future in done:
+                    item = pending.pop(future)
+                    try:
+                        face_locations, face_encodings, _ = future.result()
+                    except FaceQualityError as e:
+                        report.append({'file': item['file'], 'status': e.reason, 'message': e.message})
+                        continue
+                    except Exception as e:
+                        report.append({'file': item['file'], 'status': 'invalid_image', 'message': str(e)})
+                        continue
+                    if not face_encodings:
+                        report.append({'file': item['file'], 'status': 'no_face'})
+                    elif len(face_encodings) > 1:
+                        report.append({'file': item['file'], 'status': 'multiple_faces', 'faces': len(face_encodings)})
+                    else:
+                        item['encoding'] = face_encodings[0]
+                        ready.append(item)
+                        report.append({'file': item['file'], 'status': 'success', 'employee_id': item['employee'].id})
+                if len(ready) >= batch_size:
+                    _flush(ready)
+                    ready.clear()
+
+            for info, stem, ext in members:
+                employee = find_employee(stem)
+                if employee is None:
+                    report.append({'file': info.filename, 'status': 'unknown_employee'})
+                    continue
+                if employee.id in seen_employees:
+                    report.append({'file': info.filename, 'status': 'duplicate', 'employee_id': employee.id})
+                    continue
+                if info.file_size > MAX_MEMBER_SIZE:
+                    report.append({'file': info.filename, 'status': 'too_large'})
+                    continue
+                seen_employees.add(employee.id)
+
+                raw_bytes = zip_file.read(info)
+                future = pool.submit(encode_image_bytes, raw_bytes, quality_options, **face_options)
+                pending[future] = {'file': info.filename, 'employee': employee, 'raw_bytes': raw_bytes, 'ext': ext}
+
+                # Keep only a bounded number of photos in memory at once
+                if len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        finally:
+            if owned_pool:
+                pool.shutdown()
+
+    _flush(ready)
+    return report
+
+
+def summarize_report(report):
+    """{status: file count} of a bulk_enroll_from_zip report"""
+    summary = {}
+    for entry in report:
+        summary[entry['status']] = summary.get(entry['status'], 0) + 1
+    return summary
+
+
+# Queues for bulk enrollment jobs. Jobs always live in FaceEnrollmentJob; a queue only
+# decides who picks them up. Select with FACE_ENROLLMENT_QUEUE.
+
+class DatabaseEnrollmentQueue:
+    """Jobs stay in the table until `manage.py process_face_enrollments` claims them"""
+
+    def enqueue(self, job_id):
+        pass
+
+
+class ThreadEnrollmentQueue:
+    """
+    Runs jobs one at a time on a background thread of the web process. Every upload of the
+    process shares one pool of FACE_ENROLLMENT_WORKERS encoder processes.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or getattr(settings, 'FACE_ENROLLMENT_WORKERS', 2)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='face-enroll')
+        self._pool = None
+
+    def enqueue(self, job_id):
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        close_old_connections()
+        try:
+            if self._pool is None:
+                self._pool = create_batch_pool(self.max_workers)
+            if claim_enrollment_job(job_id):
+                if process_enrollment_job(job_id, pool=self._pool, max_workers=self.max_workers) == 'failed':
+                    # A crashed encoder process breaks the pool for good; start the next job on a fresh one
+                    self._pool.shutdown(wait=False, cancel_futures=True)
+                    self._pool = None
+        finally:
+            close_old_connections()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_enrollment_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                backend = import_string(getattr(
+                    settings, 'FACE_ENROLLMENT_QUEUE', 'employees.face_enrollment.ThreadEnrollmentQueue'
+                ))
+                _queue = backend(**dict(getattr(settings, 'FACE_ENROLLMENT_QUEUE_OPTIONS', {})))
+    return _queue
+
+
+def queue_face_enrollment(company, archive, created_by=None):
+    """Store an uploaded ZIP as a FaceEnrollmentJob and hand it to the queue once committed"""
+    job = FaceEnrollmentJob.objects.create(company=company, created_by=created_by, archive=archive)
+    transaction.on_commit(lambda: get_enrollment_queue().enqueue(job.id))
+    return job
+
+
+def claim_enrollment_job(job_id):
+    """Atomically move a pending job to processing; False if another worker got it first"""
+    return FaceEnrollmentJob.objects.filter(id=job_id, status='pending').update(
+        status='processing', started_at=timezone.now()
+    ) == 1
+
+
+def requeue_stale_enrollment_jobs(timeout_seconds):
+    """Jobs left in processing by a worker that died are put back in the queue"""
+    cutoff = timezone.now() - timedelta(seconds=timeout_seconds)
+    return FaceEnrollmentJob.objects.filter(status='processing', started_at__lt=cutoff).update(status='pending')
+
+
+def process_enrollment_job(job_id, pool=None, max_workers=None):
+    """Encode a claimed job's archive and store the report; returns 'completed' or 'failed'"""
+    job = FaceEnrollmentJob.objects.select_related('company').get(id=job_id)
+    face_settings = CompanyFaceSettings.for_company(job.company_id)
+    status, message, report = 'completed', None, None
+    try:
+        with job.archive.open('rb') as archive:
+            report = bulk_enroll_from_zip(
+                archive, job.company, face_settings.pipeline_options(),
+                quality_options=face_settings.quality_options(), max_workers=max_workers, pool=pool
+            )
+    except zipfile.BadZipFile:
+        status, message = 'failed', 'Uploaded file is not a valid ZIP archive'
+    except Exception as e:
+        logger.exception(f"Face enrollment job {job_id} failed")
+        status, message = 'failed', str(e)[:255]
+
+    FaceEnrollmentJob.objects.filter(id=job.id).update(
+        status=status,
+        message=message,
+        summary=summarize_report(report) if report is not None else None,
+        results=report,
+        completed_at=timezone.now(),
+    )
+    if job.archive:
+        job.archive.delete(save=False)
+        FaceEnrollmentJob.objects.filter(id=job.id).update(archive=None)
+    return status
+
+
+def face_enrollment_job_to_dict(job):
+    done = job.status in ('completed', 'failed')
+    summary = job.summary or {}
+    return {
+        'job_id': job.id,
+        'company_id': job.company_id,
+        'status': job.status,
+        'message': job.message,
+        'summary': summary,
+        'enrolled': summary.get('success', 0),
+        'results': job.results if done else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'completed_at': job.completed_at.isoformat() if job.completed_at else None,
+    }
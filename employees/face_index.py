@@ -0,0 +1,176 @@
+import threading
+
+import numpy as np
+from django.db.models import Count, Max
+
+from .face_utils import ENCODING_DTYPE, ENCODING_SIZE, parse_encoding, usable_encoding_versions
+from .face_store import get_shared_store, schedule_store_rebuild, store_enabled
+
+
+class CompanyFaceIndex:
+    """
+    All registered encodings of one company in a single contiguous (N, 128) matrix,
+    so a 1:N lookup is one vectorized distance computation. Only rows of a usable
+    encoding version are indexed (see face_utils.usable_encoding_versions).
+    """
+
+    def __init__(self, company_id):
+        self.company_id = company_id
+        self.matrix = np.empty((0, ENCODING_SIZE), dtype=ENCODING_DTYPE)
+        self.employee_ids = np.empty(0, dtype=np.int64)
+        self._positions = {}  # employee_id -> row in matrix
+        self.row_count = 0  # rows seen in the DB, including unparseable ones
+        self.last_updated_at = None
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.employee_ids)
+
+    def _queryset(self):
+        from .models import EmployeeFaceData
+        return EmployeeFaceData.objects.filter(
+            employee__company_id=self.company_id, encoding_version__in=usable_encoding_versions()
+        )
+
+    def rebuild(self):
+        """Load every encoding of the company from the database"""
+        rows = []
+        row_count = 0
+        last_updated_at = None
+        queryset = self._queryset().only(
+            'employee_id', 'face_encoding', 'face_encoding_binary', 'updated_at'
+        )
+        for face_data in queryset.iterator(chunk_size=500):
+            if face_data.face_encoding_binary is None and face_data.face_encoding is None:
+                continue
+            row_count += 1
+            if last_updated_at is None or face_data.updated_at > last_updated_at:
+                last_updated_at = face_data.updated_at
+            try:
+                vector = parse_encoding(face_data)
+            except ValueError:
+                continue
+            rows.append((face_data.employee_id, vector))
+
+        with self.lock:
+            if rows:
+                self.employee_ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+                self.matrix = np.ascontiguousarray(np.vstack([r[1] for r in rows]), dtype=ENCODING_DTYPE)
+            else:
+                self.employee_ids = np.empty(0, dtype=np.int64)
+                self.matrix = np.empty((0, ENCODING_SIZE), dtype=ENCODING_DTYPE)
+            self._positions = {int(emp_id): i for i, emp_id in enumerate(self.employee_ids)}
+            self.row_count = row_count
+            self.last_updated_at = last_updated_at
+
+    def upsert(self, employee_id, vector, updated_at=None):
+        """Add or replace a single employee's encoding without rebuilding"""
+        vector = np.asarray(vector, dtype=ENCODING_DTYPE).reshape(1, ENCODING_SIZE)
+        with self.lock:
+            position = self._positions.get(employee_id)
+            if position is None:
+                self.matrix = np.ascontiguousarray(np.vstack([self.matrix, vector]))
+                self.employee_ids = np.append(self.employee_ids, employee_id)
+                self._positions[employee_id] = len(self.employee_ids) - 1
+                self.row_count += 1
+            else:
+                # Copy-on-write so readers holding the old matrix stay consistent
+                matrix = self.matrix.copy()
+                matrix[position] = vector
+                self.matrix = matrix
+            if updated_at and (self.last_updated_at is None or updated_at > self.last_updated_at):
+                self.last_updated_at = updated_at
+
+    def remove(self, employee_id):
+        with self.lock:
+            position = self._positions.pop(employee_id, None)
+            if position is None:
+                return
+            self.matrix = np.ascontiguousarray(np.delete(self.matrix, position, axis=0))
+            self.employee_ids = np.delete(self.employee_ids, position)
+            self._positions = {int(emp_id): i for i, emp_id in enumerate(self.employee_ids)}
+            self.row_count -= 1
+
+    def sync(self):
+        """
+        Catch up with changes made by other worker processes: one aggregate query,
+        then either fetch only newer rows or rebuild if rows were deleted.
+        """
+        stats = self._queryset().exclude(
+            face_encoding_binary__isnull=True, face_encoding__isnull=True
+        ).aggregate(total=Count('id'), latest=Max('updated_at'))
+        if stats['latest'] == self.last_updated_at and stats['total'] == self.row_count:
+            return
+        if stats['total'] < self.row_count or self.last_updated_at is None:
+            self.rebuild()
+            return
+
+        newer = self._queryset().filter(updated_at__gt=self.last_updated_at).only(
+            'employee_id', 'face_encoding', 'face_encoding_binary', 'updated_at'
+        )
+        for face_data in newer:
+            try:
+                vector = parse_encoding(face_data)
+            except ValueError:
+                continue
+            if vector is not None:
+                self.upsert(face_data.employee_id, vector, face_data.updated_at)
+        if stats['total'] != self.row_count:
+            self.rebuild()
+
+    def search(self, encoding):
+        """Return (employee_id, distance) of the nearest registered face, or (None, None)"""
+        with self.lock:
+            matrix, employee_ids = self.matrix, self.employee_ids
+        if not len(employee_ids):
+            return None, None
+        encoding = np.asarray(encoding, dtype=ENCODING_DTYPE)
+        distances = np.linalg.norm(matrix - encoding, axis=1)
+        best = int(np.argmin(distances))
+        return int(employee_ids[best]), float(distances[best])
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_build_locks = {}  # company_id -> lock held while that company's first index is built
+
+
+def get_company_index(company_id, sync=True):
+    """
+    Return the process-wide index of a company, building it on first use.
+    An index is only published once built; concurrent first callers wait for that build.
+    With FACE_STORE_ENABLED this is the memory-mapped store shared by all workers instead.
+    """
+    if store_enabled():
+        return get_shared_store(company_id, sync=sync)
+    index = _indexes.get(company_id)
+    if index is None:
+        with _indexes_lock:
+            build_lock = _build_locks.setdefault(company_id, threading.Lock())
+        with build_lock:
+            index = _indexes.get(company_id)
+            if index is None:
+                index = CompanyFaceIndex(company_id)
+                index.rebuild()
+                with _indexes_lock:
+                    _indexes[company_id] = index
+                return index
+    if sync:
+        index.sync()
+    return index
+
+
+def update_face_index(face_data):
+    """Incrementally apply a saved EmployeeFaceData to an already loaded company index"""
+    company_id = face_data.employee.company_id
+    if store_enabled():
+        schedule_store_rebuild(company_id)
+        return
+    index = _indexes.get(company_id)
+    if index is None:
+        return  # Built lazily on the first kiosk lookup
+    vector = face_data.get_encoding()
+    if vector is None or face_data.encoding_version not in usable_encoding_versions():
+        index.remove(face_data.employee_id)
+    else:
+        index.upsert(face_data.employee_id, vector, face_data.updated_at)
@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import threading
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, Max
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, so the shared store stays off
+    fcntl = None
+
+from .face_utils import ENCODING_DTYPE, ENCODING_SIZE, parse_encoding, usable_encoding_versions
+
+KEEP_GENERATIONS = 2  # current + previous, for readers still mapping the old files
+
+logger = logging.getLogger(__name__)
+
+
+def store_enabled():
+    return fcntl is not None and getattr(settings, 'FACE_STORE_ENABLED', False)
+
+
+def _store_root():
+    return str(getattr(settings, 'FACE_STORE_DIR', os.path.join(settings.BASE_DIR, 'var', 'face_store')))
+
+
+class SharedFaceStore:
+    """
+    A company's EmployeeFaceData vectors written to .npy files and memory-mapped read-only,
+    so every gunicorn worker on the host shares the same pages instead of holding its own copy.
+
+    Layout of <FACE_STORE_DIR>/company_<id>/:
+        <generation>.vectors.npy   (N, 128) float32, rows sorted by employee id
+        <generation>.ids.npy       (N,) int64 employee ids
+        <generation>.updated.npy   (N,) float64 updated_at timestamps
+        current.json               manifest naming the live generation
+    A rebuild writes a new generation and swaps current.json with os.replace, so readers
+    always see a complete set of files.
+    Only rows of a usable encoding version are stored; the manifest records which versions
+    those were, so changing FACE_ENCODING_VERSION triggers a rebuild.
+    """
+
+    def __init__(self, company_id):
+        self.company_id = company_id
+        self.directory = os.path.join(_store_root(), f"company_{company_id}")
+        self.manifest_path = os.path.join(self.directory, 'current.json')
+        self.generation = None
+        self.manifest = {}
+        self._manifest_mtime = None
+        self.matrix = np.empty((0, ENCODING_SIZE), dtype=ENCODING_DTYPE)
+        self.employee_ids = np.empty(0, dtype=np.int64)
+        self.updated = np.empty(0, dtype=np.float64)
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.employee_ids)
+
+    def _path(self, generation, name):
+        return os.path.join(self.directory, f"{generation}.{name}.npy")
+
+    def _queryset(self):
+        from .models import EmployeeFaceData
+        return EmployeeFaceData.objects.filter(
+            employee__company_id=self.company_id, encoding_version__in=usable_encoding_versions()
+        )
+
+    def refresh(self):
+        """Re-map the files if another process swapped in a new generation (one stat call otherwise)"""
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return False
+        # os.replace gives every manifest a new inode, so this also catches swaps within one mtime tick
+        mtime = (stat.st_ino, stat.st_mtime_ns)
+        if mtime == self._manifest_mtime:
+            return True
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        generation = manifest['generation']
+        try:
+            matrix = np.load(self._path(generation, 'vectors'), mmap_mode='r')
+            employee_ids = np.load(self._path(generation, 'ids'), mmap_mode='r')
+            updated = np.load(self._path(generation, 'updated'), mmap_mode='r')
+        except FileNotFoundError:
+            return False  # swapped again while we were reading; the next call maps the newer one
+        with self.lock:
+            self.matrix, self.employee_ids, self.updated = matrix, employee_ids, updated
+            self.generation, self.manifest, self._manifest_mtime = generation, manifest, mtime
+        return True
+
+    def _stats(self):
+        stats = self._queryset().exclude(
+            face_encoding_binary__isnull=True, face_encoding__isnull=True
+        ).aggregate(total=Count('id'), latest=Max('updated_at'))
+        return stats['total'], stats['latest'].isoformat() if stats['latest'] else None, usable_encoding_versions()
+
+    def _is_current(self, stats):
+        return (self.manifest.get('rows'), self.manifest.get('latest'), self.manifest.get('versions')) == stats
+
+    def sync(self):
+        """One aggregate query; rebuild and swap the files if enrollments changed since the last build"""
+        self.refresh()
+        stats = self._stats()
+        if self._is_current(stats):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock_file:
+            # One worker rebuilds, the others wait and then map its result
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                stats = self._stats()
+                if not self._is_current(stats):
+                    self.rebuild(stats)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def rebuild(self, stats=None):
+        """Write a new generation from the database and atomically make it current"""
+        stats = stats or self._stats()
+        rows = []
+        queryset = self._queryset().only(
+            'employee_id', 'face_encoding', 'face_encoding_binary', 'updated_at'
+        ).order_by('employee_id')
+        for face_data in queryset.iterator(chunk_size=500):
+            try:
+                vector = parse_encoding(face_data)
+            except ValueError:
+                continue
+            if vector is not None:
+                rows.append((face_data.employee_id, vector, face_data.updated_at.timestamp()))
+
+        generation = uuid.uuid4().hex
+        os.makedirs(self.directory, exist_ok=True)
+        arrays = {
+            'vectors': np.vstack([r[1] for r in rows]).astype(ENCODING_DTYPE)
+            if rows else np.empty((0, ENCODING_SIZE), dtype=ENCODING_DTYPE),
+            'ids': np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)),
+            'updated': np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows)),
+        }
+        for name, array in arrays.items():
+            self._write_atomic(self._path(generation, name), lambda f, a=array: np.save(f, a))
+
+        manifest = {'generation': generation, 'rows': stats[0], 'latest': stats[1], 'versions': stats[2]}
+        self._write_atomic(self.manifest_path, lambda f: f.write(json.dumps(manifest).encode()))
+        self.refresh()
+        self._remove_old_generations()
+
+    def _write_atomic(self, path, write):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _remove_old_generations(self):
+        # Unlinking is safe for processes that still map an old file; the pages live until they unmap
+        generations = {}
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                path = os.path.join(self.directory, name)
+                generations.setdefault(name.split('.', 1)[0], []).append(path)
+        stale = sorted(
+            (g for g in generations if g != self.generation),
+            key=lambda g: max(os.path.getmtime(p) for p in generations[g]),
+            reverse=True
+        )[KEEP_GENERATIONS - 1:]
+        for generation in stale:
+            for path in generations[generation]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def get(self, employee_id, updated_at=None):
+        """
+        Read-only view of an employee's vector, or None if it is missing or older than
+        `updated_at` (a newer enrollment the store has not been rebuilt for yet).
+        """
+        self.refresh()
+        with self.lock:
+            matrix, employee_ids, updated = self.matrix, self.employee_ids, self.updated
+        position = int(np.searchsorted(employee_ids, employee_id))
+        if position >= len(employee_ids) or employee_ids[position] != employee_id:
+            return None
+        if updated_at is not None and updated[position] != updated_at.timestamp():
+            return None
+        return matrix[position]
+
+    def search(self, encoding):
+        """Return (employee_id, distance) of the nearest registered face, or (None, None)"""
+        with self.lock:
+            matrix, employee_ids = self.matrix, self.employee_ids
+        if not len(employee_ids):
+            return None, None
+        distances = np.linalg.norm(matrix - np.asarray(encoding, dtype=ENCODING_DTYPE), axis=1)
+        best = int(np.argmin(distances))
+        return int(employee_ids[best]), float(distances[best])
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_shared_store(company_id, sync=True):
+    """Return this process's handle on a company's shared store, syncing it with the database"""
+    with _stores_lock:
+        store = _stores.get(company_id)
+        if store is None:
+            store = SharedFaceStore(company_id)
+            _stores[company_id] = store
+    if sync:
+        store.sync()
+    return store
+
+
+_rebuilds = {}  # company_id -> True if another change arrived while its rebuild thread runs
+_rebuilds_lock = threading.Lock()
+
+
+def _run_rebuilds(company_id):
+    try:
+        while True:
+            with _rebuilds_lock:
+                _rebuilds[company_id] = False
+            get_shared_store(company_id, sync=True)
+            with _rebuilds_lock:
+                if not _rebuilds[company_id]:
+                    del _rebuilds[company_id]
+                    return
+    except Exception:
+        logger.exception("Face store rebuild failed for company %s", company_id)
+        with _rebuilds_lock:
+            _rebuilds.pop(company_id, None)
+    finally:
+        # This thread's ORM queries opened a connection of its own
+        close_old_connections()
+
+
+def schedule_store_rebuild(company_id):
+    """
+    Swap in a fresh generation in the background after an enrollment change.
+    Changes arriving while a company's rebuild runs are folded into one more sync
+    by the same thread; returns the new thread, or None if one was already running.
+    """
+    with _rebuilds_lock:
+        if company_id in _rebuilds:
+            _rebuilds[company_id] = True
+            return None
+        _rebuilds[company_id] = False
+    thread = threading.Thread(target=_run_rebuilds, args=(company_id,), name=f"face-store-{company_id}")
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def get_shared_encoding(company_id, face_data):
+    """Primary encoding of face_data from the shared store; None if the store is off or behind"""
+    if not store_enabled() or company_id is None:
+        return None
+    return get_shared_store(company_id, sync=False).get(face_data.employee_id, face_data.updated_at)
@@ -0,0 +1,480 @@
+import base64
+import binascii
+import hashlib
+import io
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+# 128-d dlib embedding stored as float32 -> 512 bytes per encoding
+ENCODING_DTYPE = np.float32
+ENCODING_SIZE = 128
+# Max euclidean distance between two encodings of the same person (face_recognition default is 0.6)
+FACE_MATCH_TOLERANCE = 0.4
+# Minimum 1 - distance accepted as the same person
+FACE_CONFIDENCE_THRESHOLD = 0.6
+# Longest edge of the grey copy used by the OpenCV quality gate
+QUALITY_CHECK_EDGE = 480
+# Side of the blank image encoded once to load the dlib models
+WARMUP_IMAGE_SIZE = 120
+
+
+class FaceQualityError(Exception):
+    """A capture rejected before (or instead of) a full encode; `reason` is machine-readable"""
+
+    def __init__(self, reason, message, metrics=None):
+        # Keep args == constructor args so the error survives pickling out of worker processes
+        super().__init__(reason, message, metrics)
+        self.reason = reason
+        self.message = message
+        self.metrics = metrics or {}
+
+    def __str__(self):
+        return self.message
+
+
+class FaceImage:
+    """Decoded face capture kept in memory (raw bytes + RGB array)"""
+
+    def __init__(self, raw_bytes, ext='png'):
+        self.raw_bytes = raw_bytes
+        self.ext = ext
+        self._array = None
+        self.timings = {}
+
+    @property
+    def array(self):
+        """RGB numpy array, decoded lazily from the raw bytes"""
+        if self._array is None:
+            started = time.perf_counter()
+            self._array = image_bytes_to_array(self.raw_bytes)
+            self.timings['load_ms'] = _elapsed_ms(started)
+        return self._array
+
+    def to_content_file(self, file_name=None):
+        """Build a ContentFile only when the image actually has to be stored"""
+        if not file_name:
+            file_name = f"{uuid.uuid4()}.{self.ext}"
+        return ContentFile(self.raw_bytes, name=file_name)
+
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def decode_base64_image(base64_string):
+    """
+    Decode a `data:image/...;base64,` string into a FaceImage.
+    Returns None if the payload is not a valid base64 image.
+    """
+    if not base64_string or not base64_string.startswith('data:image'):
+        return None
+    started = time.perf_counter()
+    try:
+        header, imgstr = base64_string.split(';base64,', 1)
+        raw_bytes = base64.b64decode(imgstr)
+    except (ValueError, binascii.Error):
+        return None
+    ext = header.split('/')[-1] or 'png'
+    face_image = FaceImage(raw_bytes, ext)
+    face_image.timings['decode_ms'] = _elapsed_ms(started)
+    return face_image
+
+
+def image_bytes_to_array(image_bytes):
+    """Same result as face_recognition.load_image_file, without touching disk"""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        return np.array(img.convert('RGB'))
+
+
+def downscale(image, max_edge):
+    """Shrink an RGB array so its longest edge is at most max_edge. Returns (image, scale)"""
+    height, width = image.shape[:2]
+    longest = max(height, width)
+    if not max_edge or longest <= max_edge:
+        return image, 1.0
+    scale = max_edge / float(longest)
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    resized = Image.fromarray(image).resize(size, Image.BILINEAR)
+    return np.asarray(resized), scale
+
+
+def _scale_box(box, scale, height, width):
+    """Map a (top, right, bottom, left) box from the downscaled image back to full resolution"""
+    top, right, bottom, left = box
+    return (
+        max(0, int(top / scale)),
+        min(width, int(round(right / scale))),
+        min(height, int(round(bottom / scale))),
+        max(0, int(left / scale)),
+    )
+
+
+def _crop_around(image, box, margin=0.25):
+    """Crop the face box plus a margin; returns (crop, box relative to the crop)"""
+    height, width = image.shape[:2]
+    top, right, bottom, left = box
+    pad_y = int((bottom - top) * margin)
+    pad_x = int((right - left) * margin)
+    y0, y1 = max(0, top - pad_y), min(height, bottom + pad_y)
+    x0, x1 = max(0, left - pad_x), min(width, right + pad_x)
+    return image[y0:y1, x0:x1], (top - y0, right - x0, bottom - y0, left - x0)
+
+
+def check_image_quality(image, min_blur_variance=50.0, min_brightness=40.0, max_brightness=220.0):
+    """
+    OpenCV pre-check run before dlib. Metrics are measured on a grey copy with a
+    480px longest edge so the check stays in the low milliseconds.
+    Returns the metrics, or raises FaceQualityError with a machine-readable reason.
+    """
+    import cv2
+
+    started = time.perf_counter()
+    height, width = image.shape[:2]
+    scale = min(1.0, QUALITY_CHECK_EDGE / float(max(height, width)))
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+    brightness = float(gray.mean())
+    blur_variance = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    metrics = {
+        'brightness': round(brightness, 2),
+        'blur_variance': round(blur_variance, 2),
+        'quality_ms': _elapsed_ms(started),
+    }
+
+    if brightness < min_brightness:
+        raise FaceQualityError('too_dark', 'The photo is too dark. Please move to a brighter spot and retake it.', metrics)
+    if brightness > max_brightness:
+        raise FaceQualityError('too_bright', 'The photo is overexposed. Please avoid direct light and retake it.', metrics)
+    if blur_variance < min_blur_variance:
+        raise FaceQualityError('too_blurry', 'The photo is blurry. Please hold the camera steady and retake it.', metrics)
+    return metrics
+
+
+def encode_faces(image, model='hog', upsample=1, num_jitters=1, max_edge=None, min_face_size=0):
+    """
+    Staged pipeline on an in-memory RGB array:
+    detect on a copy downscaled to max_edge, map the boxes back to full
+    resolution, then encode only the crop around each face.
+    Faces smaller than min_face_size px are rejected before encoding.
+    Returns (face_locations, face_encodings, timings); lists are empty if no face is found.
+    """
+    import face_recognition
+
+    timings = {}
+    height, width = image.shape[:2]
+
+    started = time.perf_counter()
+    small, scale = downscale(image, max_edge)
+    timings['downscale_ms'] = _elapsed_ms(started)
+
+    started = time.perf_counter()
+    small_locations = face_recognition.face_locations(
+        small, number_of_times_to_upsample=upsample, model=model
+    )
+    timings['detect_ms'] = _elapsed_ms(started)
+    if not small_locations:
+        return [], [], timings
+
+    face_locations = [_scale_box(box, scale, height, width) for box in small_locations]
+    if min_face_size:
+        large_enough = [
+            box for box in face_locations
+            if min(box[2] - box[0], box[1] - box[3]) >= min_face_size
+        ]
+        if not large_enough:
+            raise FaceQualityError(
+                'face_too_small',
+                'Your face is too small in the photo. Please move closer to the camera.',
+                {'min_face_size': min_face_size, **timings}
+            )
+        face_locations = large_enough
+
+    started = time.perf_counter()
+    face_encodings = []
+    for box in face_locations:
+        crop, crop_box = _crop_around(image, box)
+        encodings = face_recognition.face_encodings(crop, [crop_box], num_jitters=num_jitters)
+        if encodings:
+            face_encodings.append(encodings[0])
+    timings['encode_ms'] = _elapsed_ms(started)
+
+    return face_locations, face_encodings, timings
+
+
+_models_loaded = threading.Event()
+
+
+def warm_up_models():
+    """
+    Load the dlib detector, landmark and ResNet models by running one encode on a blank image.
+    Returns the time it took in ms.
+    """
+    started = time.perf_counter()
+    import face_recognition
+
+    blank = np.zeros((WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, 3), dtype=np.uint8)
+    face_recognition.face_locations(blank)
+    face_recognition.face_encodings(blank, [(10, WARMUP_IMAGE_SIZE - 10, WARMUP_IMAGE_SIZE - 10, 10)])
+    _models_loaded.set()
+    return _elapsed_ms(started)
+
+
+def models_loaded():
+    """True once warm_up_models() has completed in this process"""
+    return _models_loaded.is_set()
+
+
+def encode_image_bytes(raw_bytes, quality_options=None, **options):
+    """
+    Decode (+ optional quality gate) + encode in one call; batch jobs ship compressed
+    bytes to worker processes, not arrays
+    """
+    image = image_bytes_to_array(raw_bytes)
+    if quality_options is not None:
+        check_image_quality(image, **quality_options)
+    return encode_faces(image, **options)
+
+
+def score_face_templates(template_matrix, encoding, tolerance=FACE_MATCH_TOLERANCE):
+    """
+    Best match of a captured encoding against an employee's (k, 128) template matrix
+    in one vectorized distance call. Returns (is_match, confidence, distance, template_index).
+    """
+    distances = np.linalg.norm(
+        np.asarray(template_matrix, dtype=ENCODING_DTYPE) - np.asarray(encoding, dtype=ENCODING_DTYPE),
+        axis=1
+    )
+    best = int(np.argmin(distances))
+    distance = float(distances[best])
+    confidence = 1.0 - distance
+    is_match = distance <= tolerance and confidence >= FACE_CONFIDENCE_THRESHOLD
+    return is_match, confidence, distance, best
+
+
+def current_encoding_version():
+    """
+    Tag stored with every encoding. Bump FACE_ENCODING_VERSION whenever the embedding model,
+    library or encode parameters change, then run `manage.py reencode_faces`.
+    """
+    return str(getattr(settings, 'FACE_ENCODING_VERSION', '1'))
+
+
+def usable_encoding_versions():
+    """
+    Versions whose vectors may be compared with a capture encoded now: the current one plus
+    FACE_ENCODING_COMPATIBLE_VERSIONS (older versions declared comparable, e.g. when only
+    num_jitters changed). Rows of any other version are ignored until they are re-encoded.
+    """
+    current = current_encoding_version()
+    compatible = [str(version) for version in getattr(settings, 'FACE_ENCODING_COMPATIBLE_VERSIONS', ())]
+    return [current] + [version for version in compatible if version != current]
+
+
+def encoding_to_bytes(encoding):
+    """Pack an encoding into 512 bytes of little-endian float32"""
+    return np.asarray(encoding, dtype='<f4').tobytes()
+
+
+def bytes_to_encoding(raw):
+    """Unpack a binary encoding (bytes or memoryview from the DB) into a float32 vector"""
+    vector = np.frombuffer(bytes(raw), dtype='<f4')
+    if vector.size != ENCODING_SIZE:
+        raise ValueError(f"Invalid face encoding size: {vector.size}")
+    return vector.astype(ENCODING_DTYPE, copy=False)
+
+
+def parse_encoding(face_data):
+    """Decode the stored encoding of an EmployeeFaceData row, preferring the binary column"""
+    if face_data.face_encoding_binary:
+        return bytes_to_encoding(face_data.face_encoding_binary)
+    if face_data.face_encoding:
+        return np.asarray(json.loads(face_data.face_encoding), dtype=ENCODING_DTYPE)
+    return None
+
+
+class EncodingCache:
+    """Thread-safe LRU of decoded encodings, one entry per employee tagged with updated_at"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, employee_id, version):
+        with self._lock:
+            entry = self._data.get(employee_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._data.move_to_end(employee_id)
+            return entry[1]
+
+    def put(self, employee_id, version, vector):
+        with self._lock:
+            self._data[employee_id] = (version, vector)
+            self._data.move_to_end(employee_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, employee_id):
+        with self._lock:
+            self._data.pop(employee_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CaptureCache:
+    """
+    Short-lived LRU of pipeline results keyed by the SHA-256 of the uploaded image bytes,
+    so a client retrying the same payload skips detection and encoding. Bounded by size and TTL.
+    """
+
+    def __init__(self, maxsize=256, ttl=120):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(raw_bytes, *options):
+        digest = hashlib.sha256(raw_bytes).hexdigest()
+        return (digest,) + tuple(tuple(sorted(o.items())) if isinstance(o, dict) else o for o in options)
+
+    def get(self, key):
+        """Cached result for key or None; counts a hit or a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result):
+        if not self.maxsize or not self.ttl:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, result)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+encoding_cache = EncodingCache(getattr(settings, 'FACE_ENCODING_CACHE_SIZE', 1024))
+template_cache = EncodingCache(getattr(settings, 'FACE_ENCODING_CACHE_SIZE', 1024))
+capture_cache = CaptureCache(
+    getattr(settings, 'FACE_CAPTURE_CACHE_SIZE', 256),
+    getattr(settings, 'FACE_CAPTURE_CACHE_TTL', 120)
+)
+
+
+def get_cached_encoding(face_data):
+    """Return the decoded encoding for face_data, parsing it at most once per updated_at"""
+    vector = encoding_cache.get(face_data.employee_id, face_data.updated_at)
+    if vector is None:
+        vector = parse_encoding(face_data)
+        if vector is None:
+            return None
+        vector.setflags(write=False)
+        encoding_cache.put(face_data.employee_id, face_data.updated_at, vector)
+    return vector
+
+
+def _cached_extra_templates(face_data):
+    """
+    (versions, matrix) of the employee's EmployeeFaceTemplate rows, cached per face_data.updated_at
+    (template changes touch that timestamp). The matrix may have zero rows.
+    """
+    entry = template_cache.get(face_data.employee_id, face_data.updated_at)
+    if entry is None:
+        from .models import EmployeeFaceTemplate
+
+        versions, vectors = [], []
+        template_blobs = EmployeeFaceTemplate.objects.filter(
+            employee_id=face_data.employee_id
+        ).values_list('encoding_version', 'face_encoding_binary')
+        for version, raw in template_blobs:
+            try:
+                vectors.append(bytes_to_encoding(raw))
+            except ValueError:
+                continue
+            versions.append(version)
+        if vectors:
+            matrix = np.ascontiguousarray(np.vstack(vectors), dtype=ENCODING_DTYPE)
+        else:
+            matrix = np.empty((0, ENCODING_SIZE), dtype=ENCODING_DTYPE)
+        matrix.setflags(write=False)
+        entry = (tuple(versions), matrix)
+        template_cache.put(face_data.employee_id, face_data.updated_at, entry)
+    return entry
+
+
+def get_cached_templates(face_data, company_id=None):
+    """
+    (k, 128) matrix of the primary encoding followed by the employee's extra templates.
+    With company_id and FACE_STORE_ENABLED the primary row is read from the shared
+    memory-mapped store instead of this process's encoding cache.
+    Captures are always encoded with the current version, so only rows of the current version
+    are used, or, for an employee with none yet, rows of the versions listed in
+    FACE_ENCODING_COMPATIBLE_VERSIONS. Returns None when no row is comparable.
+    """
+    primary = None
+    if company_id is not None:
+        from .face_store import get_shared_encoding
+        primary = get_shared_encoding(company_id, face_data)
+    if primary is None:
+        primary = get_cached_encoding(face_data)
+
+    versions, extras = _cached_extra_templates(face_data)
+    row_versions = ([face_data.encoding_version] if primary is not None else []) + list(versions)
+    current = current_encoding_version()
+    if current in row_versions:
+        keep = [version == current for version in row_versions]
+    else:
+        usable = set(usable_encoding_versions())
+        keep = [version in usable for version in row_versions]
+    if not any(keep):
+        return None
+
+    if primary is not None:
+        use_primary, keep = keep[0], keep[1:]
+    else:
+        use_primary = False
+    if not any(keep):
+        # Only the primary: a (1, 128) view, no copy
+        return np.asarray(primary, dtype=ENCODING_DTYPE).reshape(1, ENCODING_SIZE)
+    rows = ([primary] if use_primary else []) + [extras[i] for i, k in enumerate(keep) if k]
+    return np.ascontiguousarray(np.vstack(rows), dtype=ENCODING_DTYPE)
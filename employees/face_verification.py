@@ -0,0 +1,214 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .face_utils import (
+    FaceImage, FaceQualityError, capture_cache, check_image_quality, score_face_templates
+)
+from .face_worker import FaceWorkerBusy, encode_faces
+from .models import Attendance, AttendanceLog, CompanyFaceSettings, EmployeeFaceData, FaceVerificationJob
+
+logger = logging.getLogger(__name__)
+
+
+def encode_face_capture(face_image, company_id, face_settings=None):
+    """
+    Company quality gate (OpenCV, a few ms) followed by the dlib pipeline on the face worker.
+    Results (including "no face" and quality rejections) are cached briefly by content hash.
+    Pass the company's CompanyFaceSettings if the caller already loaded them.
+    Raises FaceQualityError / FaceWorkerBusy; returns (face_locations, face_encodings, timings).
+    """
+    if face_settings is None:
+        face_settings = CompanyFaceSettings.for_company(company_id)
+    quality_options = face_settings.quality_options()
+    pipeline_options = face_settings.pipeline_options()
+
+    # A retry of the same payload (same bytes, same settings) reuses the earlier result
+    started = time.perf_counter()
+    cache_key = capture_cache.key(face_image.raw_bytes, quality_options, pipeline_options)
+    cached = capture_cache.get(cache_key)
+    hash_ms = round((time.perf_counter() - started) * 1000, 2)
+    if cached is not None:
+        if isinstance(cached, FaceQualityError):
+            raise cached
+        face_locations, face_encodings = cached
+        return face_locations, face_encodings, {**face_image.timings, 'hash_ms': hash_ms, 'cache': 'hit'}
+
+    quality = {}
+    try:
+        if quality_options is not None:
+            quality = check_image_quality(face_image.array, **quality_options)
+        face_locations, face_encodings, timings = encode_faces(face_image.array, **pipeline_options)
+    except FaceQualityError as e:
+        capture_cache.put(cache_key, e)
+        raise
+    capture_cache.put(cache_key, (face_locations, face_encodings))
+    return face_locations, face_encodings, {**face_image.timings, 'hash_ms': hash_ms, 'cache': 'miss', **quality, **timings}
+
+
+# Queues for deferred face checks. Jobs always live in FaceVerificationJob; a queue only
+# decides who picks them up. Select with FACE_VERIFICATION_QUEUE.
+
+class DatabaseVerificationQueue:
+    """Production queue: jobs stay in the table until `manage.py process_face_verifications` claims them"""
+
+    def enqueue(self, job_id):
+        pass
+
+
+class ThreadVerificationQueue:
+    """Local stand-in: verifies jobs on a small thread pool inside the web process"""
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='face-verify')
+
+    def enqueue(self, job_id):
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        close_old_connections()
+        try:
+            if claim_verification_job(job_id):
+                process_verification_job(job_id)
+        finally:
+            close_old_connections()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_verification_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                backend = import_string(getattr(
+                    settings, 'FACE_VERIFICATION_QUEUE', 'employees.face_verification.DatabaseVerificationQueue'
+                ))
+                _queue = backend(**dict(getattr(settings, 'FACE_VERIFICATION_QUEUE_OPTIONS', {})))
+    return _queue
+
+
+def queue_face_verification(attendance, attendance_log, face_image):
+    """
+    Record a deferred face check for a punch and hand it to the queue once the
+    surrounding transaction commits. `face_image` is a stored file or a ContentFile.
+    """
+    job = FaceVerificationJob.objects.create(
+        attendance=attendance,
+        attendance_log=attendance_log,
+        employee_id=attendance.employee_id,
+        face_image=face_image,
+    )
+    transaction.on_commit(lambda: get_verification_queue().enqueue(job.id))
+    return job
+
+
+def claim_verification_job(job_id):
+    """Atomically move a pending job to processing; False if another worker got it first"""
+    return FaceVerificationJob.objects.filter(id=job_id, status='pending').update(
+        status='processing', started_at=timezone.now()
+    ) == 1
+
+
+def requeue_stale_jobs(timeout_seconds):
+    """Jobs left in processing by a worker that died are put back in the queue"""
+    cutoff = timezone.now() - timedelta(seconds=timeout_seconds)
+    return FaceVerificationJob.objects.filter(status='processing', started_at__lt=cutoff).update(status='pending')
+
+
+def _finish(job, status, message=None, face_confidence=None):
+    """Store the outcome on the job, the attendance record and the punch's log entry"""
+    now = timezone.now()
+    is_verified = status == 'verified'
+    with transaction.atomic():
+        FaceVerificationJob.objects.filter(id=job.id).update(
+            status=status, message=message, face_confidence=face_confidence, completed_at=now
+        )
+        Attendance.objects.filter(id=job.attendance_id).update(
+            is_face_verified=is_verified,
+            face_confidence=face_confidence,
+            face_verification_status=status,
+            updated_at=now
+        )
+        if job.attendance_log_id:
+            log = AttendanceLog.objects.filter(id=job.attendance_log_id).first()
+            if log:
+                log.face_verification_result = is_verified
+                log.face_confidence = face_confidence
+                result = 'verified' if is_verified else f"{status}: {message}"
+                log.log_message = f"{log.log_message or ''} (face check {result})".strip()
+                log.save(update_fields=['face_verification_result', 'face_confidence', 'log_message'])
+
+
+def process_verification_job(job_id):
+    """
+    Run the face check of a claimed job. Returns the final status, or 'pending'
+    if the face worker was busy and the job should be retried.
+    """
+    job = FaceVerificationJob.objects.select_related('employee').get(id=job_id)
+    max_attempts = getattr(settings, 'FACE_VERIFICATION_MAX_ATTEMPTS', 3)
+    FaceVerificationJob.objects.filter(id=job.id).update(attempts=job.attempts + 1)
+
+    face_data = EmployeeFaceData.objects.filter(employee_id=job.employee_id).first()
+    template_matrix = face_data.get_template_matrix(job.employee.company_id) if face_data else None
+    if template_matrix is None:
+        _finish(job, 'failed', 'Face data not registered')
+        return 'failed'
+
+    try:
+        with job.face_image.open('rb') as f:
+            raw_bytes = f.read()
+    except (FileNotFoundError, OSError, ValueError):
+        _finish(job, 'failed', 'Captured image is missing')
+        return 'failed'
+
+    ext = job.face_image.name.rsplit('.', 1)[-1] if '.' in job.face_image.name else 'png'
+    try:
+        _, face_encodings, _ = encode_face_capture(FaceImage(raw_bytes, ext), job.employee.company_id)
+    except FaceWorkerBusy:
+        if job.attempts + 1 >= max_attempts:
+            _finish(job, 'failed', 'Face worker busy')
+            return 'failed'
+        FaceVerificationJob.objects.filter(id=job.id).update(status='pending')
+        return 'pending'
+    except FaceQualityError as e:
+        _finish(job, 'rejected', e.message)
+        return 'rejected'
+    except Exception as e:
+        logger.exception(f"Error verifying face for job {job.id}")
+        _finish(job, 'failed', str(e)[:255])
+        return 'failed'
+
+    if not face_encodings:
+        _finish(job, 'rejected', 'No face detected in the image')
+        return 'rejected'
+
+    is_match, face_confidence, _, _ = score_face_templates(template_matrix, face_encodings[0])
+    if is_match:
+        _finish(job, 'verified', face_confidence=face_confidence)
+        return 'verified'
+    _finish(job, 'rejected', 'Face does not match the registered face', face_confidence)
+    return 'rejected'
+
+
+def face_verification_job_to_dict(job):
+    return {
+        'job_id': job.id,
+        'attendance_id': job.attendance_id,
+        'status': job.status,
+        'is_face_verified': job.status == 'verified',
+        'face_confidence': job.face_confidence,
+        'message': job.message,
+        'attempts': job.attempts,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'completed_at': job.completed_at.isoformat() if job.completed_at else None,
+    }
@@ -0,0 +1,185 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class FaceWorkerBusy(Exception):
+    """Raised when the face worker queue is saturated; views answer 503 + Retry-After"""
+
+    def __init__(self, retry_after, message='Face worker queue is full'):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BaseFaceWorker:
+    """
+    Admission control shared by all backends: at most `concurrency` jobs run and
+    `queue_depth` more may wait. Anything beyond that is rejected immediately.
+    """
+
+    def __init__(self, concurrency=2, queue_depth=8, timeout=30, retry_after=2):
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(concurrency + queue_depth)
+        self.warmup_ms = None
+        self.warmup_error = None
+
+    def run(self, func, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise FaceWorkerBusy(self.retry_after)
+        return self._run_admitted(func, *args, **kwargs)
+
+    def _run_admitted(self, func, *args, **kwargs):
+        """Run a job that holds an admission slot; the slot must be released once the job is done"""
+        try:
+            return self._execute(func, *args, **kwargs)
+        finally:
+            self._slots.release()
+
+    def _execute(self, func, *args, **kwargs):
+        raise NotImplementedError
+
+    @property
+    def ready(self):
+        """True once the dlib models are loaded wherever this backend runs jobs"""
+        return self.warmup_ms is not None
+
+    def warm_up(self):
+        """Run the dummy encode on every executor so the first real request is not a cold start"""
+        from .face_utils import warm_up_models
+        try:
+            self.warmup_ms = self._warm_up(warm_up_models)
+            self.warmup_error = None
+        except Exception as e:
+            self.warmup_error = str(e)
+            logger.exception("Face worker warm-up failed")
+        return self.ready
+
+    def _warm_up(self, warm_up_func):
+        return self._execute(warm_up_func)
+
+    def encode(self, image, **options):
+        """Detect and encode faces in a decoded RGB array (options: see face_utils.encode_faces)"""
+        from .face_utils import encode_faces
+        return self.run(encode_faces, image, **options)
+
+
+class InlineFaceWorker(BaseFaceWorker):
+    """Local stand-in that runs jobs in the request thread (dev, tests, single-process setups)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._running = threading.BoundedSemaphore(self.concurrency)
+
+    def _execute(self, func, *args, **kwargs):
+        if not self._running.acquire(timeout=self.timeout):
+            raise FaceWorkerBusy(self.retry_after, 'Timed out waiting for a face worker')
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._running.release()
+
+
+class ProcessPoolFaceWorker(BaseFaceWorker):
+    """Runs dlib detection/encoding in a bounded pool of separate processes"""
+
+    def __init__(self, *args, start_method='spawn', preload=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        initializer = None
+        if preload:
+            from .face_utils import warm_up_models
+            initializer = warm_up_models  # pool processes recycled later come up warm too
+        # Spawned lazily inside each gunicorn worker, never inherited across a fork
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.concurrency,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=initializer,
+        )
+
+    def _run_admitted(self, func, *args, **kwargs):
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        # A timed-out job keeps running in its process, so it keeps its slot until it really ends
+        future.add_done_callback(lambda _: self._slots.release())
+        return self._wait(future)
+
+    def _execute(self, func, *args, **kwargs):
+        return self._wait(self._executor.submit(func, *args, **kwargs))
+
+    def _wait(self, future):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise FaceWorkerBusy(self.retry_after, 'Face worker timed out')
+
+    def _warm_up(self, warm_up_func):
+        # Processes are spawned on demand; submitting one job per slot at once starts all of them
+        futures = [self._executor.submit(warm_up_func) for _ in range(self.concurrency)]
+        return max(future.result(timeout=self.timeout * 4) for future in futures)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_face_worker = None
+_face_worker_lock = threading.Lock()
+
+
+def get_face_worker():
+    """Return the configured face worker of this process (FACE_WORKER_BACKEND)"""
+    global _face_worker
+    if _face_worker is None:
+        with _face_worker_lock:
+            if _face_worker is None:
+                backend = import_string(getattr(
+                    settings, 'FACE_WORKER_BACKEND', 'employees.face_worker.ProcessPoolFaceWorker'
+                ))
+                options = dict(getattr(settings, 'FACE_WORKER_OPTIONS', {}))
+                if issubclass(backend, ProcessPoolFaceWorker):
+                    options.setdefault('preload', getattr(settings, 'FACE_PRELOAD_MODELS', False))
+                _face_worker = backend(
+                    concurrency=getattr(settings, 'FACE_WORKER_CONCURRENCY', 2),
+                    queue_depth=getattr(settings, 'FACE_WORKER_QUEUE_DEPTH', 8),
+                    timeout=getattr(settings, 'FACE_WORKER_TIMEOUT', 30),
+                    retry_after=getattr(settings, 'FACE_WORKER_RETRY_AFTER', 2),
+                    **options
+                )
+    return _face_worker
+
+
+def encode_faces(image, **options):
+    """Drop-in for face_utils.encode_faces that goes through the face worker"""
+    return get_face_worker().encode(image, **options)
+
+
+def start_face_warmup():
+    """Warm the face worker of this process in a background thread (see EmployeesConfig.ready)"""
+    thread = threading.Thread(target=lambda: get_face_worker().warm_up(), name='face-warmup')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def create_batch_pool(max_workers=None):
+    """
+    Process pool for offline/bulk jobs (enrollment imports, re-encoding, benchmarks).
+    Uses every core by default and is not subject to the request worker's queue limits.
+    """
+    start_method = dict(getattr(settings, 'FACE_WORKER_OPTIONS', {})).get('start_method', 'spawn')
+    return ProcessPoolExecutor(
+        max_workers=max_workers or os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context(start_method),
+    )
@@ -0,0 +1,375 @@
+import math
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+EARTH_RADIUS_M = 6371000  # same constant as views.calculate_distance
+METERS_PER_DEGREE = 111320.0
+DEFAULT_SITE_ID = -1  # EmployeeFaceData default coordinates, shown as "Default Location"
+MAX_CELLS_PER_SITE = 400  # sites with a huge radius are checked for every punch instead
+
+
+def haversine_distances(latitude, longitude, latitudes, longitudes):
+    """Distances in meters from one point to arrays of points, in a single vectorized pass"""
+    lat1 = np.radians(float(latitude))
+    lon1 = np.radians(float(longitude))
+    lat2 = np.radians(latitudes)
+    lon2 = np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GeofenceResult:
+    """Outcome of checking one punch against a set of sites"""
+
+    def __init__(self, sites, distances):
+        self.sites = sites
+        self.distances = distances
+        self.inside = distances <= sites.radii
+        self.min_distance = float(distances.min()) if len(distances) else None
+
+    @property
+    def nearest_match(self):
+        """(index, distance) of the closest allowed location containing the punch, or None"""
+        candidates = np.flatnonzero(self.inside & (self.sites.ids != DEFAULT_SITE_ID))
+        if not len(candidates):
+            return None
+        best = int(candidates[np.argmin(self.distances[candidates])])
+        return best, float(self.distances[best])
+
+    def matches(self):
+        """Every site containing the punch, nearest first"""
+        order = np.flatnonzero(self.inside)
+        order = order[np.argsort(self.distances[order])]
+        return [
+            {
+                'location_id': int(self.sites.ids[i]) if self.sites.ids[i] != DEFAULT_SITE_ID else None,
+                'location_name': self.sites.names[i],
+                'distance': round(float(self.distances[i]), 2),
+                'allowed_radius': float(self.sites.radii[i]),
+            }
+            for i in order
+        ]
+
+    def default_distance(self):
+        """(distance, inside) for the employee's default location, or None if none is set"""
+        return self.distance_to(DEFAULT_SITE_ID)
+
+    def distance_to(self, location_id):
+        """(distance, inside) for one site id, or None if the site is not in the set"""
+        index = self.sites.index_of(location_id)
+        if index is None:
+            return None
+        return float(self.distances[index]), bool(self.inside[index])
+
+
+class GeofenceSites:
+    """Sites (active EmployeeLocation rows and default coordinates) as parallel NumPy arrays"""
+
+    def __init__(self, ids, names, latitudes, longitudes, radii, employee_ids=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.names = list(names)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.radii = np.asarray(radii, dtype=np.float64)
+        self.employee_ids = np.asarray(employee_ids if employee_ids is not None else [], dtype=np.int64)
+        self._positions = {int(location_id): i for i, location_id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def subset(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        return GeofenceSites(
+            self.ids[indices], [self.names[i] for i in indices],
+            self.latitudes[indices], self.longitudes[indices], self.radii[indices],
+            self.employee_ids[indices] if len(self.employee_ids) else None
+        )
+
+    def index_of(self, location_id):
+        return self._positions.get(int(location_id))
+
+    def check(self, latitude, longitude):
+        distances = haversine_distances(latitude, longitude, self.latitudes, self.longitudes)
+        return GeofenceResult(self, distances)
+
+
+class GeofenceGrid:
+    """
+    Grid-cell index over every site of a company. Each site is registered in all cells its
+    radius can reach, so a punch only needs an exact haversine check against the sites
+    listed in its own cell.
+    """
+
+    def __init__(self, sites, cell_meters):
+        self.sites = sites
+        self.cell_degrees = cell_meters / METERS_PER_DEGREE
+        self.built_at = time.monotonic()
+        self.version = None
+        cells = {}
+        always = []
+        for i in range(len(sites)):
+            keys = self._cells_for(sites.latitudes[i], sites.longitudes[i], sites.radii[i])
+            if keys is None:
+                always.append(i)
+                continue
+            for key in keys:
+                cells.setdefault(key, []).append(i)
+        self.cells = {key: np.asarray(indices, dtype=np.int64) for key, indices in cells.items()}
+        self.always = np.asarray(always, dtype=np.int64)
+        by_employee = {}
+        for i, employee_id in enumerate(sites.employee_ids.tolist()):
+            by_employee.setdefault(employee_id, []).append(i)
+        self.by_employee = {e: np.asarray(indices, dtype=np.int64) for e, indices in by_employee.items()}
+
+    def _cell(self, latitude, longitude):
+        return (math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees))
+
+    def _cells_for(self, latitude, longitude, radius):
+        """Cells overlapping the bounding box of a site's circle (None if there are too many)"""
+        lat_span = radius / METERS_PER_DEGREE
+        # Use the circle's poleward edge, where a degree of longitude is shortest
+        lon_span = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(min(abs(latitude) + lat_span, 90.0))), 0.01))
+        low = self._cell(latitude - lat_span, longitude - lon_span)
+        high = self._cell(latitude + lat_span, longitude + lon_span)
+        if (high[0] - low[0] + 1) * (high[1] - low[1] + 1) > MAX_CELLS_PER_SITE:
+            return None
+        return [(y, x) for y in range(low[0], high[0] + 1) for x in range(low[1], high[1] + 1)]
+
+    @classmethod
+    def for_company(cls, company_id, cell_meters):
+        """Two values_list queries: active EmployeeLocation rows and default face-data coordinates"""
+        from .models import EmployeeFaceData, EmployeeLocation
+
+        rows = list(EmployeeLocation.objects.filter(
+            employee__company_id=company_id, is_active=True
+        ).values_list('id', 'location_name', 'latitude', 'longitude', 'allowed_radius', 'employee_id'))
+        defaults = EmployeeFaceData.objects.filter(
+            employee__company_id=company_id,
+            default_latitude__isnull=False, default_longitude__isnull=False
+        ).values_list('default_latitude', 'default_longitude', 'allowed_radius', 'employee_id')
+        rows += [
+            (DEFAULT_SITE_ID, 'Default Location', lat, lon, radius or 100, employee_id)
+            for lat, lon, radius, employee_id in defaults
+        ]
+        if not rows:
+            return cls(GeofenceSites([], [], [], [], [], []), cell_meters)
+        ids, names, latitudes, longitudes, radii, employee_ids = zip(*rows)
+        return cls(GeofenceSites(ids, names, latitudes, longitudes, radii, employee_ids), cell_meters)
+
+    def check(self, employee_id, latitude, longitude):
+        """
+        GeofenceResult over the employee's sites. Only the sites in the punch's cell get an
+        exact distance; the rest are computed only if none of those contains the punch.
+        """
+        own = self.by_employee.get(employee_id)
+        if own is None:
+            return GeofenceResult(GeofenceSites([], [], [], [], []), np.empty(0))
+        employee_sites = self.sites.subset(own)
+
+        candidates = self.cells.get(self._cell(float(latitude), float(longitude)))
+        candidates = self.always if candidates is None else np.union1d(candidates, self.always)
+        local = np.flatnonzero(np.isin(own, candidates))
+
+        distances = np.full(len(own), np.inf)
+        if len(local):
+            distances[local] = haversine_distances(
+                latitude, longitude, employee_sites.latitudes[local], employee_sites.longitudes[local]
+            )
+        result = GeofenceResult(employee_sites, distances)
+        if not result.inside.any():
+            # Punch rejected: exact distances to every site so the nearest one can be reported
+            result = employee_sites.check(latitude, longitude)
+        return result
+
+
+# Per-employee geofence cache (Django cache framework, see CACHES). Entries are plain dicts so any
+# backend can hold them; employees.signals deletes an entry whenever its rows change.
+
+def _employee_key(employee_id):
+    return f"geofence:employee:{employee_id}"
+
+
+def location_entry(location):
+    """Serializable form of an EmployeeLocation (the shape location_to_dict returns)"""
+    entry = {
+        'id': location.id,
+        'location_name': location.location_name,
+        'latitude': location.latitude,
+        'longitude': location.longitude,
+        'allowed_radius': location.allowed_radius,
+        'is_active': location.is_active,
+        'created_at': location.created_at.isoformat(),
+        'updated_at': location.updated_at.isoformat(),
+    }
+    if location.created_by:
+        entry['created_by_name'] = location.created_by.get_full_name() or location.created_by.username
+    return entry
+
+
+def _load_employee_geofences(employee_ids):
+    """Two queries for any number of employees: their locations and their default coordinates"""
+    from .models import EmployeeFaceData, EmployeeLocation
+
+    entries = {employee_id: {'locations': [], 'default': None} for employee_id in employee_ids}
+    locations = EmployeeLocation.objects.filter(
+        employee_id__in=employee_ids
+    ).select_related('created_by').order_by('id')
+    for location in locations:
+        entries[location.employee_id]['locations'].append(location_entry(location))
+    defaults = EmployeeFaceData.objects.filter(employee_id__in=employee_ids).values_list(
+        'employee_id', 'default_latitude', 'default_longitude', 'allowed_radius', 'created_at', 'updated_at'
+    )
+    for employee_id, latitude, longitude, radius, created_at, updated_at in defaults:
+        if latitude and longitude:
+            entries[employee_id]['default'] = {
+                'latitude': latitude,
+                'longitude': longitude,
+                'allowed_radius': radius or 100,
+                'created_at': created_at.isoformat(),
+                'updated_at': updated_at.isoformat(),
+            }
+    return entries
+
+
+def get_employee_geofences_many(employee_ids):
+    """{employee_id: {'locations': [...all rows...], 'default': {...} or None}}, read through the cache"""
+    employee_ids = list(employee_ids)
+    keys = {_employee_key(employee_id): employee_id for employee_id in employee_ids}
+    cached = cache.get_many(list(keys))
+    result = {keys[key]: entry for key, entry in cached.items()}
+    missing = [employee_id for employee_id in employee_ids if employee_id not in result]
+    if missing:
+        loaded = _load_employee_geofences(missing)
+        cache.set_many(
+            {_employee_key(employee_id): entry for employee_id, entry in loaded.items()},
+            getattr(settings, 'GEOFENCE_CACHE_TTL', 3600)
+        )
+        result.update(loaded)
+    return result
+
+
+def get_employee_geofences(employee_id):
+    return get_employee_geofences_many([employee_id])[employee_id]
+
+
+def invalidate_employee_geofences(employee_id):
+    cache.delete(_employee_key(employee_id))
+
+
+def invalidate_employee_geofences_many(employee_ids):
+    """For bulk writes, which do not send post_save"""
+    cache.delete_many([_employee_key(employee_id) for employee_id in employee_ids])
+
+
+def employee_sites(entry):
+    """GeofenceSites for the active locations of a cached entry plus its default coordinates"""
+    rows = [
+        (loc['id'], loc['location_name'], loc['latitude'], loc['longitude'], loc['allowed_radius'])
+        for loc in entry['locations'] if loc['is_active']
+    ]
+    default = entry['default']
+    if default:
+        rows.append((DEFAULT_SITE_ID, 'Default Location', default['latitude'], default['longitude'],
+                     default['allowed_radius']))
+    if not rows:
+        return GeofenceSites([], [], [], [], [])
+    return GeofenceSites(*zip(*rows))
+
+
+def check_employee_geofence(employee, latitude, longitude):
+    """
+    Geofence check for a punch, without touching the database on a warm cache.
+    Employees with very large site catalogs go through the company grid index instead.
+    """
+    sites = employee_sites(get_employee_geofences(employee.id))
+    if len(sites) > getattr(settings, 'GEOFENCE_GRID_MIN_SITES', 64):
+        return get_company_grid(employee.company_id).check(employee.id, latitude, longitude)
+    return sites.check(latitude, longitude)
+
+
+def assign_location_to_employees(employee_ids, company_id, location_name, latitude, longitude,
+                                 allowed_radius=100, is_active=True, created_by=None, batch_size=500):
+    """
+    Give every employee in `employee_ids` the same site with one bulk insert.
+    Employees that already have a location called `location_name` keep theirs
+    (the (employee, location_name) unique constraint). Returns (created, skipped).
+    On Oracle, a row inserted concurrently by another request raises IntegrityError
+    and nothing is written; elsewhere such rows are skipped and not counted as created.
+    """
+    from .models import EmployeeLocation
+
+    employee_ids = set(employee_ids)
+    ignore_conflicts = connection.features.supports_ignore_conflicts
+    with transaction.atomic():
+        existing = set(EmployeeLocation.objects.filter(
+            employee_id__in=employee_ids, location_name=location_name
+        ).values_list('employee_id', flat=True))
+        new_rows = [
+            EmployeeLocation(
+                employee_id=employee_id,
+                location_name=location_name,
+                latitude=latitude,
+                longitude=longitude,
+                allowed_radius=allowed_radius,
+                is_active=is_active,
+                created_by=created_by,
+            )
+            for employee_id in sorted(employee_ids - existing)
+        ]
+        # Oracle has no ON CONFLICT; there the pre-filter above is what avoids the conflicts
+        inserted_at = timezone.now()
+        EmployeeLocation.objects.bulk_create(new_rows, batch_size=batch_size, ignore_conflicts=ignore_conflicts)
+        created = len(new_rows)
+        if ignore_conflicts and new_rows:
+            # Rows dropped as conflicts belong to another request: count only the ones this call wrote
+            created = EmployeeLocation.objects.filter(
+                employee_id__in=[row.employee_id for row in new_rows],
+                location_name=location_name,
+                created_by=created_by,
+                created_at__gte=inserted_at,
+            ).count()
+
+    # bulk_create does not send post_save, so drop the caches employees.signals would have
+    invalidate_employee_geofences_many([row.employee_id for row in new_rows])
+    invalidate_company_geofence(company_id)
+    return created, len(employee_ids) - created
+
+
+_grids = {}
+_grids_lock = threading.Lock()
+
+
+def _version_key(company_id):
+    return f"geofence:version:{company_id}"
+
+
+def invalidate_company_geofence(company_id):
+    """Called on EmployeeLocation / default-location changes (see employees.signals)"""
+    with _grids_lock:
+        _grids.pop(company_id, None)
+    try:
+        cache.incr(_version_key(company_id))
+    except ValueError:
+        cache.set(_version_key(company_id), 1, None)
+
+
+def get_company_grid(company_id):
+    """
+    This process's grid of a company. Rebuilt when another process bumped the company's
+    version in the shared cache, and at the latest after GEOFENCE_GRID_TTL seconds.
+    """
+    version = cache.get(_version_key(company_id))
+    ttl = getattr(settings, 'GEOFENCE_GRID_TTL', 300)
+    grid = _grids.get(company_id)
+    if grid is None or grid.version != version or time.monotonic() - grid.built_at > ttl:
+        grid = GeofenceGrid.for_company(company_id, getattr(settings, 'GEOFENCE_GRID_CELL_METERS', 500))
+        grid.version = version
+        with _grids_lock:
+            _grids[company_id] = grid
+    return grid
@@ -0,0 +1,203 @@
+import base64
+import glob
+import io
+import json
+import os
+import platform
+import time
+from concurrent.futures import wait
+
+import numpy as np
+from PIL import Image
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from employees.face_utils import (
+    decode_base64_image, encode_faces, score_face_templates, warm_up_models, ENCODING_DTYPE
+)
+from employees.face_worker import create_batch_pool
+
+STAGES = ('decode_ms', 'load_ms', 'downscale_ms', 'detect_ms', 'encode_ms', 'compare_ms', 'search_ms', 'total_ms')
+
+
+def run_stages(payload, options):
+    """One check-in worth of work on a `data:image/...;base64,` payload, timed per stage"""
+    started = time.perf_counter()
+    face_image = decode_base64_image(payload)
+    image = face_image.array
+    _, face_encodings, timings = encode_faces(image, **options)
+    timings.update(face_image.timings)
+    timings['total_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return timings, (face_encodings[0] if face_encodings else None)
+
+
+def summarize(values):
+    if not values:
+        return None
+    values = np.asarray(values, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': int(values.size),
+        'mean': round(float(values.mean()), 2),
+        'p50': round(float(p50), 2),
+        'p95': round(float(p95), 2),
+        'p99': round(float(p99), 2),
+        'max': round(float(values.max()), 2),
+    }
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v.strip() != '']
+
+
+class Command(BaseCommand):
+    help = 'Replays stored face images through the face pipeline and reports per-stage latency as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--models', default='hog,cnn', help='Detection models to run, comma separated')
+        parser.add_argument('--max-edges', default='0,480,640,960', help='Detection downscale sizes in px (0 = full size)')
+        parser.add_argument('--workers', default='1,2,4', help='Process pool sizes to measure throughput with')
+        parser.add_argument('--limit', type=int, default=50, help='Max images to replay (0 = all)')
+        parser.add_argument('--repeat', type=int, default=1, help='Times each image is replayed per run')
+        parser.add_argument('--gallery-size', type=int, default=1000, help='Rows in the synthetic 1:N search matrix')
+        parser.add_argument('--label', default='', help='Free text stored with the results, e.g. a release tag')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def _collect_images(self, limit):
+        """Payloads of the stored images; unreadable or undecodable files are skipped and listed"""
+        media_root = str(settings.MEDIA_ROOT)
+        paths = sorted(glob.glob(os.path.join(media_root, 'face_*.png')))
+        paths += sorted(glob.glob(os.path.join(media_root, 'attendance', 'faces', '*.*')))
+        used, payloads, skipped = [], [], []
+        for path in paths:
+            if limit and len(payloads) >= limit:
+                break
+            try:
+                with open(path, 'rb') as f:
+                    raw_bytes = f.read()
+            except OSError as e:
+                skipped.append({'file': path, 'reason': 'unreadable', 'message': str(e)})
+                continue
+            try:
+                with Image.open(io.BytesIO(raw_bytes)) as img:
+                    img.verify()
+            except Exception as e:
+                skipped.append({'file': path, 'reason': 'undecodable', 'message': str(e)})
+                continue
+            ext = os.path.splitext(path)[1].lstrip('.').lower() or 'png'
+            used.append(path)
+            payloads.append(f"data:image/{ext};base64,{base64.b64encode(raw_bytes).decode()}")
+        return used, payloads, skipped
+
+    def _run(self, payloads, options, workers, repeat, template_count, gallery_size):
+        jobs = [payload for payload in payloads for _ in range(repeat)]
+        stage_values = {stage: [] for stage in STAGES}
+        encodings = []
+
+        with create_batch_pool(workers) as pool:
+            # Start and warm every process first so pool startup and model loading are not measured
+            wait([pool.submit(warm_up_models) for _ in range(workers)])
+            started = time.perf_counter()
+            futures = [pool.submit(run_stages, payload, options) for payload in jobs]
+            results, errors = [], 0
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception:
+                    # e.g. a file PIL could verify but not load; the rest of the run is still measured
+                    errors += 1
+            wall_s = time.perf_counter() - started
+
+        for timings, encoding in results:
+            for stage, value in timings.items():
+                if stage in stage_values:
+                    stage_values[stage].append(value)
+            if encoding is not None:
+                encodings.append(np.asarray(encoding, dtype=ENCODING_DTYPE))
+
+        if encodings:
+            # Comparison stages run in-process on the collected encodings:
+            # 1:1 against a template matrix, and 1:N against a gallery the size of a large company
+            gallery = np.vstack(encodings)
+            gallery = np.ascontiguousarray(np.resize(gallery, (max(gallery_size, 1), gallery.shape[1])))
+            templates = np.ascontiguousarray(np.resize(gallery, (template_count, gallery.shape[1])))
+            for encoding in encodings:
+                started = time.perf_counter()
+                score_face_templates(templates, encoding)
+                stage_values['compare_ms'].append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                int(np.argmin(np.linalg.norm(gallery - encoding, axis=1)))
+                stage_values['search_ms'].append((time.perf_counter() - started) * 1000)
+
+        return {
+            'model': options['model'],
+            'max_edge': options['max_edge'] or 0,
+            'workers': workers,
+            'images': len(jobs),
+            'faces_found': len(encodings),
+            'errors': errors,
+            'wall_s': round(wall_s, 3),
+            'throughput_per_s': round(len(jobs) / wall_s, 2) if wall_s else None,
+            'stages': {stage: summarize(values) for stage, values in stage_values.items()},
+        }
+
+    def handle(self, *args, **options):
+        models = [m.strip() for m in options['models'].split(',') if m.strip()]
+        invalid = [m for m in models if m not in ('hog', 'cnn')]
+        if invalid:
+            raise CommandError(f"Unknown detection model(s): {', '.join(invalid)}")
+
+        paths, payloads, skipped = self._collect_images(options['limit'])
+        for entry in skipped:
+            self.stderr.write(f"Skipping {entry['file']} ({entry['reason']}): {entry['message']}")
+        if not payloads:
+            raise CommandError(f"No readable face images found under {settings.MEDIA_ROOT}")
+        self.stderr.write(f"Replaying {len(payloads)} images ({len(skipped)} skipped)")
+
+        runs = []
+        for model in models:
+            for max_edge in _int_list(options['max_edges']):
+                for workers in _int_list(options['workers']):
+                    pipeline_options = {
+                        'model': model,
+                        'upsample': getattr(settings, 'FACE_DETECTION_UPSAMPLE', 1),
+                        'num_jitters': getattr(settings, 'FACE_NUM_JITTERS', 1),
+                        'max_edge': max_edge or None,
+                    }
+                    run = self._run(
+                        payloads, pipeline_options, workers, options['repeat'],
+                        getattr(settings, 'FACE_MAX_TEMPLATES', 5) + 1, options['gallery_size']
+                    )
+                    runs.append(run)
+                    total = run['stages']['total_ms'] or {}
+                    self.stderr.write(
+                        f"{model} max_edge={max_edge} workers={workers}: "
+                        f"p50={total.get('p50')}ms p95={total.get('p95')}ms "
+                        f"{run['throughput_per_s']} img/s, {run['faces_found']}/{run['images']} faces, {run['errors']} errors"
+                    )
+
+        report = {
+            'label': options['label'],
+            'created_at': timezone.now().isoformat(),
+            'host': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'images': len(payloads),
+            'repeat': options['repeat'],
+            'gallery_size': options['gallery_size'],
+            'sources': [os.path.relpath(p, str(settings.MEDIA_ROOT)) for p in paths],
+            'skipped': [
+                {**entry, 'file': os.path.relpath(entry['file'], str(settings.MEDIA_ROOT))} for entry in skipped
+            ],
+            'runs': runs,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stdout.write(self.style.SUCCESS(f"Benchmark results written to {options['output']}"))
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,67 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.models import Company
+from employees.face_duplicates import find_duplicate_faces
+from employees.face_utils import FACE_MATCH_TOLERANCE
+from employees.models import EmployeeProfile
+
+
+class Command(BaseCommand):
+    help = 'Reports pairs of different employees of a company whose enrolled faces look like the same person'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help='Company id to scan (default: every company)')
+        parser.add_argument(
+            '--threshold', type=float, default=FACE_MATCH_TOLERANCE,
+            help=f'Max face distance reported as a duplicate (default {FACE_MATCH_TOLERANCE})'
+        )
+        parser.add_argument('--block-size', type=int, default=2048, help='Rows per distance tile (memory ~ block^2 floats)')
+        parser.add_argument('--include-templates', action='store_true', help='Also compare extra enrollment templates')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        companies = Company.objects.all()
+        if options['company']:
+            companies = companies.filter(id=options['company'])
+            if not companies.exists():
+                raise CommandError(f"Company {options['company']} not found")
+
+        report = []
+        for company in companies.order_by('id'):
+            started = time.perf_counter()
+            pairs = find_duplicate_faces(
+                company.id,
+                threshold=options['threshold'],
+                block_size=options['block_size'],
+                include_templates=options['include_templates'],
+            )
+            if pairs:
+                ids = {p['employee_a'] for p in pairs} | {p['employee_b'] for p in pairs}
+                employees = {
+                    e.id: e for e in EmployeeProfile.objects.filter(id__in=ids).select_related('user')
+                }
+                for pair in pairs:
+                    for key in ('employee_a', 'employee_b'):
+                        employee = employees.get(pair[key])
+                        pair[key] = {
+                            'id': pair[key],
+                            'name': employee.full_name if employee else None,
+                            'username': employee.user.username if employee and employee.user else None,
+                        }
+            report.append({'company_id': company.id, 'company': company.name, 'pairs': pairs})
+            self.stdout.write(
+                f"{company.name}: {len(pairs)} suspicious pairs ({time.perf_counter() - started:.1f}s)"
+            )
+            for pair in pairs:
+                self.stdout.write(
+                    f"  {pair['employee_a']['name']} (#{pair['employee_a']['id']}) <-> "
+                    f"{pair['employee_b']['name']} (#{pair['employee_b']['id']}): {pair['distance']}"
+                )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
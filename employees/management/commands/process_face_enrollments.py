@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from employees.face_enrollment import (
+    claim_enrollment_job, process_enrollment_job, requeue_stale_enrollment_jobs
+)
+from employees.face_worker import create_batch_pool
+from employees.models import FaceEnrollmentJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Worker for bulk face enrollment uploads (FACE_ENROLLMENT_QUEUE = DatabaseEnrollmentQueue); '
+        'encodes on one process pool kept for the lifetime of the worker'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process the current backlog and exit')
+        parser.add_argument('--workers', type=int, default=None, help='Encoder processes (default: every core)')
+        parser.add_argument('--sleep', type=float, default=5.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument(
+            '--stale-after', type=int, default=3600,
+            help='Seconds after which a job stuck in processing is put back in the queue'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Face enrollment worker started")
+        with create_batch_pool(options['workers']) as pool:
+            while True:
+                requeue_stale_enrollment_jobs(options['stale_after'])
+                job_ids = list(
+                    FaceEnrollmentJob.objects.filter(status='pending')
+                    .order_by('created_at').values_list('id', flat=True)[:10]
+                )
+                processed = 0
+                for job_id in job_ids:
+                    # Several workers may poll the same rows; the conditional update decides who runs a job
+                    if not claim_enrollment_job(job_id):
+                        continue
+                    status = process_enrollment_job(job_id, pool=pool, max_workers=options['workers'])
+                    processed += 1
+                    self.stdout.write(f"Job {job_id}: {status}")
+
+                if options['once'] and not processed:
+                    break
+                if not processed:
+                    time.sleep(options['sleep'])
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from employees.face_verification import (
+    claim_verification_job, process_verification_job, requeue_stale_jobs
+)
+from employees.models import FaceVerificationJob
+
+
+class Command(BaseCommand):
+    help = 'Worker for deferred face checks (async verification mode); run one or more alongside the web workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process the current backlog and exit')
+        parser.add_argument('--batch-size', type=int, default=20, help='Jobs fetched per poll')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument(
+            '--stale-after', type=int, default=getattr(settings, 'FACE_WORKER_TIMEOUT', 30) * 4,
+            help='Seconds after which a job stuck in processing is put back in the queue'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Face verification worker started")
+        while True:
+            requeue_stale_jobs(options['stale_after'])
+            job_ids = list(
+                FaceVerificationJob.objects.filter(status='pending')
+                .order_by('created_at').values_list('id', flat=True)[:options['batch_size']]
+            )
+            processed = 0
+            for job_id in job_ids:
+                # Several workers may poll the same rows; the conditional update decides who runs a job
+                if not claim_verification_job(job_id):
+                    continue
+                status = process_verification_job(job_id)
+                processed += 1
+                self.stdout.write(f"Job {job_id}: {status}")
+
+            if options['once'] and not processed:
+                break
+            if not processed:
+                time.sleep(options['sleep'])
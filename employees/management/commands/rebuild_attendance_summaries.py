@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from employees.attendance_summary import rebuild_daily_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recomputes AttendanceDailySummary rows from the raw Attendance records (backfill or repair)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help='Company id to rebuild (default: every company)')
+        parser.add_argument('--start', help='First date to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Last date to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Summary rows per bulk insert')
+        parser.add_argument(
+            '--employees-per-chunk', type=int, default=100,
+            help='Employees rebuilt per transaction (their punches wait while it runs)'
+        )
+
+    def handle(self, *args, **options):
+        dates = {}
+        for name in ('start', 'end'):
+            if options[name]:
+                dates[name] = parse_date(options[name])
+                if dates[name] is None:
+                    raise CommandError(f"--{name} must be a date (YYYY-MM-DD)")
+
+        started = time.perf_counter()
+        created = rebuild_daily_summaries(
+            company_id=options['company'],
+            start_date=dates.get('start'),
+            end_date=dates.get('end'),
+            batch_size=options['batch_size'],
+            employees_per_chunk=options['employees_per_chunk'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {created} daily summaries in {time.perf_counter() - started:.1f}s"
+        ))
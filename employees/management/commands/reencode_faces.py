@@ -0,0 +1,139 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from employees.face_utils import current_encoding_version, encode_image_bytes, encoding_to_bytes
+from employees.face_worker import create_batch_pool
+from employees.models import CompanyFaceSettings, EmployeeFaceData, EmployeeFaceTemplate
+
+
+def _largest_face(face_locations, face_encodings):
+    """Enrollment photos should hold one face; if not, keep the biggest one"""
+    if len(face_encodings) == 1:
+        return face_encodings[0]
+    if not face_encodings or len(face_locations) != len(face_encodings):
+        return None
+    areas = [(bottom - top) * (right - left) for top, right, bottom, left in face_locations]
+    return face_encodings[areas.index(max(areas))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-encodes stored face images with the current model and parameters (FACE_ENCODING_VERSION). '
+        'Resumable: rows already at the target version are skipped, so an interrupted run can simply be restarted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Rows encoded and written per batch')
+        parser.add_argument('--workers', type=int, default=None, help='Process pool size (default: all cores)')
+        parser.add_argument('--company', type=int, help='Only re-encode employees of this company id')
+        parser.add_argument('--from-id', type=int, default=0, help='Start after this row id')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Also re-encode rows already at the target version (resume with --from-id)'
+        )
+        parser.add_argument('--skip-templates', action='store_true', help='Leave EmployeeFaceTemplate rows untouched')
+
+    def handle(self, *args, **options):
+        self.target_version = current_encoding_version()
+        self.face_options = {}  # company_id -> pipeline options
+        self.stdout.write(f"Re-encoding faces to version {self.target_version}")
+
+        with create_batch_pool(options['workers']) as pool:
+            self._reencode(pool, EmployeeFaceData, options)
+            if not options['skip_templates']:
+                self._reencode(pool, EmployeeFaceTemplate, options)
+
+    def _options_for(self, company_id):
+        if company_id not in self.face_options:
+            pipeline_options = CompanyFaceSettings.for_company(company_id).pipeline_options()
+            # Stored enrollment photos were accepted once already; do not re-apply the quality gate
+            pipeline_options['min_face_size'] = 0
+            self.face_options[company_id] = pipeline_options
+        return self.face_options[company_id]
+
+    def _reencode(self, pool, model, options):
+        queryset = model.objects.exclude(face_image='').exclude(face_image__isnull=True)
+        if not options['force']:
+            queryset = queryset.exclude(encoding_version=self.target_version)
+        if options['company']:
+            queryset = queryset.filter(employee__company_id=options['company'])
+        queryset = queryset.select_related('employee').order_by('id')
+
+        label = model._meta.verbose_name_plural
+        counts = {'updated': 0, 'no_face': 0, 'missing_file': 0, 'failed': 0}
+        last_id = options['from_id']
+        started = time.perf_counter()
+
+        while True:
+            # Keyset pagination on id: constant cost per page and safe to resume from last_id
+            batch = list(queryset.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            futures = {}
+            for row in batch:
+                try:
+                    with row.face_image.open('rb') as f:
+                        raw_bytes = f.read()
+                except (FileNotFoundError, OSError, ValueError):
+                    counts['missing_file'] += 1
+                    continue
+                futures[row.id] = pool.submit(
+                    encode_image_bytes, raw_bytes, **self._options_for(row.employee.company_id)
+                )
+
+            changed = []
+            for row in batch:
+                future = futures.get(row.id)
+                if future is None:
+                    continue
+                try:
+                    face_locations, face_encodings, _ = future.result()
+                except Exception as e:
+                    counts['failed'] += 1
+                    self.stderr.write(f"{label} {row.id}: {e}")
+                    continue
+                encoding = _largest_face(face_locations, face_encodings)
+                if encoding is None:
+                    counts['no_face'] += 1
+                    continue
+                if model is EmployeeFaceData:
+                    row.set_encoding(encoding)
+                else:
+                    row.face_encoding_binary = encoding_to_bytes(encoding)
+                    row.encoding_version = self.target_version
+                changed.append(row)
+
+            self._write(model, changed)
+            counts['updated'] += len(changed)
+            self.stdout.write(
+                f"{label}: up to id {last_id} - {counts['updated']} updated, {counts['no_face']} without a face, "
+                f"{counts['missing_file']} missing files, {counts['failed']} failed"
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{label}: done in {time.perf_counter() - started:.1f}s - {counts['updated']} re-encoded"
+        ))
+
+    def _write(self, model, rows):
+        if not rows:
+            return
+        now = timezone.now()
+        with transaction.atomic():
+            if model is EmployeeFaceData:
+                for row in rows:
+                    row.updated_at = now
+                model.objects.bulk_update(
+                    rows, ['face_encoding', 'face_encoding_binary', 'encoding_version', 'updated_at'],
+                    batch_size=len(rows)
+                )
+            else:
+                model.objects.bulk_update(rows, ['face_encoding_binary', 'encoding_version'], batch_size=len(rows))
+                # Template matrices are cached per face_data.updated_at
+                EmployeeFaceData.objects.filter(
+                    employee_id__in={row.employee_id for row in rows}
+                ).update(updated_at=now)
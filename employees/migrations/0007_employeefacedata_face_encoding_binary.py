@@ -0,0 +1,38 @@
+import json
+
+import numpy as np
+from django.db import migrations, models
+
+
+def convert_json_encodings(apps, schema_editor):
+    EmployeeFaceData = apps.get_model('employees', 'EmployeeFaceData')
+    rows = EmployeeFaceData.objects.filter(
+        face_encoding__isnull=False, face_encoding_binary__isnull=True
+    ).only('id', 'face_encoding')
+    for face_data in rows.iterator(chunk_size=500):
+        try:
+            encoding = json.loads(face_data.face_encoding)
+        except (TypeError, ValueError):
+            continue
+        if len(encoding) != 128:
+            continue
+        # .update() keeps updated_at untouched
+        EmployeeFaceData.objects.filter(id=face_data.id).update(
+            face_encoding_binary=np.asarray(encoding, dtype='<f4').tobytes()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0006_attendance_shift'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employeefacedata',
+            name='face_encoding_binary',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(convert_json_encodings, migrations.RunPython.noop),
+    ]
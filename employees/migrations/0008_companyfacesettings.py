@@ -0,0 +1,26 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0003_teamcategory_team_teammember'),
+        ('employees', '0007_employeefacedata_face_encoding_binary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyFaceSettings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('detection_model', models.CharField(choices=[('hog', 'HOG (CPU, fast)'), ('cnn', 'CNN (accurate, slow without GPU)')], default='hog', max_length=10)),
+                ('upsample_times', models.PositiveSmallIntegerField(default=1)),
+                ('num_jitters', models.PositiveSmallIntegerField(default=1)),
+                ('detection_max_edge', models.PositiveIntegerField(default=640)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='face_settings', to='companies.company')),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0008_companyfacesettings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='face_confidence',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='attendancelog',
+            name='face_confidence',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+import django.db.models.deletion
+import employees.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0009_attendance_face_confidence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmployeeFaceTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('face_image', models.ImageField(blank=True, null=True, upload_to=employees.models.face_image_path)),
+                ('face_encoding_binary', models.BinaryField(editable=False)),
+                ('label', models.CharField(blank=True, max_length=100, null=True)),
+                ('capture_metadata', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='face_templates', to='employees.employeeprofile')),
+            ],
+            options={
+                'ordering': ['employee', 'created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0010_employeefacetemplate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='companyfacesettings',
+            name='quality_check_enabled',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='companyfacesettings',
+            name='min_blur_variance',
+            field=models.FloatField(default=50.0),
+        ),
+        migrations.AddField(
+            model_name='companyfacesettings',
+            name='min_brightness',
+            field=models.FloatField(default=40.0),
+        ),
+        migrations.AddField(
+            model_name='companyfacesettings',
+            name='max_brightness',
+            field=models.FloatField(default=220.0),
+        ),
+        migrations.AddField(
+            model_name='companyfacesettings',
+            name='min_face_size',
+            field=models.PositiveIntegerField(default=80),
+        ),
+    ]
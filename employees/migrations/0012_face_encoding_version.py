@@ -0,0 +1,23 @@
+import employees.face_utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0011_companyfacesettings_quality_gate'),
+    ]
+
+    operations = [
+        # Existing rows are tagged with the version configured when the migration runs
+        migrations.AddField(
+            model_name='employeefacedata',
+            name='encoding_version',
+            field=models.CharField(db_index=True, default=employees.face_utils.current_encoding_version, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='employeefacetemplate',
+            name='encoding_version',
+            field=models.CharField(db_index=True, default=employees.face_utils.current_encoding_version, max_length=64),
+        ),
+    ]
@@ -0,0 +1,44 @@
+import django.db.models.deletion
+import employees.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0012_face_encoding_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='face_verification_status',
+            field=models.CharField(choices=[('verified', 'Verified'), ('pending', 'Pending'), ('rejected', 'Rejected'), ('failed', 'Failed')], default='verified', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='companyfacesettings',
+            name='async_verification',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='FaceVerificationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('face_image', models.ImageField(upload_to=employees.models.face_image_path)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('verified', 'Verified'), ('rejected', 'Rejected'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('face_confidence', models.FloatField(blank=True, null=True)),
+                ('message', models.CharField(blank=True, max_length=255, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('attendance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='face_verification_jobs', to='employees.attendance')),
+                ('attendance_log', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='employees.attendancelog')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='employees.employeeprofile')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='face_verif_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0001_initial'),
+        ('employees', '0014_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceDailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('first_check_in', models.DateTimeField(blank=True, null=True)),
+                ('last_check_out', models.DateTimeField(blank=True, null=True)),
+                ('total_minutes', models.PositiveIntegerField(default=0)),
+                ('record_count', models.PositiveSmallIntegerField(default=0)),
+                ('punch_count', models.PositiveSmallIntegerField(default=0)),
+                ('open_sessions', models.PositiveSmallIntegerField(default=0)),
+                ('status', models.CharField(choices=[('present', 'Present'), ('absent', 'Absent'), ('late', 'Late'), ('leave', 'Leave')], default='absent', max_length=20)),
+                ('late_minutes', models.PositiveIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='companies.company')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_summaries', to='employees.employeeprofile')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['company', 'date'], name='att_summary_company_date_idx')],
+                'unique_together': {('employee', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0016_attendance_history_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='companyfacesettings',
+            name='quality_check_enabled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='companyfacesettings',
+            name='min_face_size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
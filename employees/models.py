@@ -143,9 +143,11 @@ class EmployeeProfile(models.Model):
 
 from django.db import models
 from django.conf import settings
+import json
 import uuid
 import os
 from employees.models import EmployeeProfile
+from employees.face_utils import current_encoding_version
 
 def face_image_path(instance, filename):
     """Generate a unique path for storing face images"""
@@ -158,6 +160,10 @@ class EmployeeFaceData(models.Model):
     employee = models.OneToOneField(EmployeeProfile, on_delete=models.CASCADE, related_name='face_data')
     face_image = models.ImageField(upload_to=face_image_path, blank=True, null=True)
     face_encoding = models.TextField(blank=True, null=True)  # Store face encoding as JSON string
+    # Same encoding packed as 128 float32 values (512 bytes) - read path used for comparisons
+    face_encoding_binary = models.BinaryField(blank=True, null=True, editable=False)
+    # Model/parameter generation the encoding was produced with (FACE_ENCODING_VERSION)
+    encoding_version = models.CharField(max_length=64, default=current_encoding_version, db_index=True)
     
     # Default location for attendance checks (office location)
     default_latitude = models.FloatField(blank=True, null=True)
@@ -172,6 +178,109 @@ class EmployeeFaceData(models.Model):
     def __str__(self):
         return f"Face data for {self.employee.full_name}"
 
+    def set_encoding(self, encoding):
+        """Store an encoding in both the binary column and the legacy JSON field"""
+        from employees.face_utils import encoding_to_bytes
+        self.face_encoding_binary = encoding_to_bytes(encoding)
+        self.encoding_version = current_encoding_version()
+        self.face_encoding = json.dumps([float(value) for value in encoding])
+
+    def get_encoding(self):
+        """Return the registered encoding as a float32 numpy vector (cached per process)"""
+        from employees.face_utils import get_cached_encoding
+        return get_cached_encoding(self)
+
+    def get_template_matrix(self, company_id=None):
+        """
+        Primary encoding plus extra EmployeeFaceTemplate rows as one (k, 128) matrix (cached).
+        Pass the employee's company_id to read the primary from the shared face store.
+        """
+        from employees.face_utils import get_cached_templates
+        return get_cached_templates(self, company_id)
+
+class EmployeeFaceTemplate(models.Model):
+    """Extra enrollment captures (lighting, glasses, ...) scored alongside the primary EmployeeFaceData"""
+    employee = models.ForeignKey(EmployeeProfile, on_delete=models.CASCADE, related_name='face_templates')
+    face_image = models.ImageField(upload_to=face_image_path, blank=True, null=True)
+    face_encoding_binary = models.BinaryField(editable=False)  # 128 x float32
+    encoding_version = models.CharField(max_length=64, default=current_encoding_version, db_index=True)
+    label = models.CharField(max_length=100, blank=True, null=True)  # e.g. "glasses", "low light"
+    capture_metadata = models.JSONField(blank=True, null=True)  # device, lighting, camera etc. sent by the client
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['employee', 'created_at']
+    
+    def __str__(self):
+        return f"Face template {self.label or self.id} for {self.employee.full_name}"
+
+class CompanyFaceSettings(models.Model):
+    """Per-company tuning of the face pipeline (accuracy vs latency)"""
+    DETECTION_MODEL_CHOICES = (
+        ('hog', 'HOG (CPU, fast)'),
+        ('cnn', 'CNN (accurate, slow without GPU)'),
+    )
+    
+    company = models.OneToOneField('companies.Company', on_delete=models.CASCADE, related_name='face_settings')
+    detection_model = models.CharField(max_length=10, choices=DETECTION_MODEL_CHOICES, default='hog')
+    upsample_times = models.PositiveSmallIntegerField(default=1)  # number_of_times_to_upsample for detection
+    num_jitters = models.PositiveSmallIntegerField(default=1)  # re-samples per encoding
+    detection_max_edge = models.PositiveIntegerField(default=640)  # longest edge of the detection image, 0 = full size
+    
+    # Cheap OpenCV pre-check, run before dlib (opt-in per company)
+    quality_check_enabled = models.BooleanField(default=False)
+    min_blur_variance = models.FloatField(default=50.0)  # variance of the Laplacian, lower = blurrier
+    min_brightness = models.FloatField(default=40.0)  # mean grey level 0-255
+    max_brightness = models.FloatField(default=220.0)
+    min_face_size = models.PositiveIntegerField(default=0)  # px, shorter side of the detected face box, 0 = any
+    
+    # Record the punch after geofence/shift checks and verify the face in the background
+    async_verification = models.BooleanField(default=False)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Face settings for {self.company.name}"
+    
+    def pipeline_options(self):
+        """Keyword arguments for face_utils.encode_faces"""
+        return {
+            'model': self.detection_model,
+            'upsample': self.upsample_times,
+            'num_jitters': self.num_jitters,
+            'max_edge': self.detection_max_edge or None,
+            'min_face_size': self.min_face_size if self.quality_check_enabled else 0,
+        }
+    
+    def quality_options(self):
+        """Keyword arguments for face_utils.check_image_quality, None when the gate is disabled"""
+        if not self.quality_check_enabled:
+            return None
+        return {
+            'min_blur_variance': self.min_blur_variance,
+            'min_brightness': self.min_brightness,
+            'max_brightness': self.max_brightness,
+        }
+    
+    @classmethod
+    def for_company(cls, company_id):
+        """Settings row of a company, or an unsaved one carrying the project defaults"""
+        face_settings = cls.objects.filter(company_id=company_id).first()
+        if face_settings:
+            return face_settings
+        return cls(
+            company_id=company_id,
+            detection_model=getattr(settings, 'FACE_DETECTION_MODEL', 'hog'),
+            upsample_times=getattr(settings, 'FACE_DETECTION_UPSAMPLE', 1),
+            num_jitters=getattr(settings, 'FACE_NUM_JITTERS', 1),
+            detection_max_edge=getattr(settings, 'FACE_DETECTION_MAX_EDGE', 640),
+            quality_check_enabled=getattr(settings, 'FACE_QUALITY_CHECK_ENABLED', False),
+            min_face_size=getattr(settings, 'FACE_MIN_FACE_SIZE', 0),
+            async_verification=getattr(settings, 'FACE_ASYNC_VERIFICATION', False),
+        )
+
+
 # employees/models.py
 
 from django.db import models
@@ -209,6 +318,12 @@ class Attendance(models.Model):
         ('late', 'Late'),
         ('leave', 'Leave'),
     )
+    FACE_VERIFICATION_STATUS = (
+        ('verified', 'Verified'),
+        ('pending', 'Pending'),
+        ('rejected', 'Rejected'),
+        ('failed', 'Failed'),
+    )
     
     employee = models.ForeignKey(EmployeeProfile, on_delete=models.CASCADE, related_name='attendance_records')
     company = models.ForeignKey("companies.Company", on_delete=models.CASCADE)
@@ -228,6 +343,9 @@ class Attendance(models.Model):
     is_location_verified = models.BooleanField(default=False)
     is_face_verified = models.BooleanField(default=False)
     is_blink_verified = models.BooleanField(default=False)  # Add this new field
+    face_confidence = models.FloatField(blank=True, null=True)  # 1 - face distance of the last verified punch
+    # 'pending' while a deferred face check (async verification mode) has not run yet
+    face_verification_status = models.CharField(max_length=20, choices=FACE_VERIFICATION_STATUS, default='verified')
     
     # Device information
     device_info = models.JSONField(blank=True, null=True)
@@ -240,6 +358,8 @@ class Attendance(models.Model):
     
     class Meta:
         ordering = ['-date', '-check_in_time']
+        # attendance_history pages through one employee's records in this order
+        indexes = [models.Index(fields=['employee', '-date', '-check_in_time', '-id'], name='attendance_emp_date_idx')]
     
     def __str__(self):
         return f"{self.employee.full_name} - {self.date} - {self.status}"
@@ -251,6 +371,34 @@ class Attendance(models.Model):
             return int(duration.total_seconds() / 60)
         return None
 
+
+class AttendanceDailySummary(models.Model):
+    """
+    One row per employee and day, derived from that day's Attendance records.
+    Kept current by employees.attendance_summary wherever attendance is written;
+    `manage.py rebuild_attendance_summaries` backfills or repairs it.
+    """
+    employee = models.ForeignKey(EmployeeProfile, on_delete=models.CASCADE, related_name='daily_summaries')
+    company = models.ForeignKey("companies.Company", on_delete=models.CASCADE)
+    date = models.DateField()
+    first_check_in = models.DateTimeField(blank=True, null=True)
+    last_check_out = models.DateTimeField(blank=True, null=True)
+    total_minutes = models.PositiveIntegerField(default=0)  # closed sessions only
+    record_count = models.PositiveSmallIntegerField(default=0)  # Attendance records of the day
+    punch_count = models.PositiveSmallIntegerField(default=0)  # check-ins + check-outs
+    open_sessions = models.PositiveSmallIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=Attendance.ATTENDANCE_STATUS, default='absent')  # of the first check-in
+    late_minutes = models.PositiveIntegerField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-date']
+        unique_together = ('employee', 'date')
+        indexes = [models.Index(fields=['company', 'date'], name='att_summary_company_date_idx')]
+    
+    def __str__(self):
+        return f"{self.employee.full_name} - {self.date} - {self.total_minutes} min"
+
 class AttendanceLog(models.Model):
     """Model for storing detailed attendance logs"""
     attendance = models.ForeignKey('employees.Attendance', on_delete=models.CASCADE, related_name='logs')
@@ -262,6 +410,7 @@ class AttendanceLog(models.Model):
     face_verification_result = models.BooleanField(default=False)
     location_verification_result = models.BooleanField(default=False)
     blink_verification_result = models.BooleanField(default=False)  # Add blink verification field
+    face_confidence = models.FloatField(blank=True, null=True)
     device_info = models.JSONField(blank=True, null=True)
     log_message = models.TextField(blank=True, null=True)
     
@@ -271,6 +420,84 @@ class AttendanceLog(models.Model):
     def __str__(self):
         return f"{self.employee.full_name} - {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
 
+class FaceVerificationJob(models.Model):
+    """A punch whose face check was deferred (async verification mode); the queue record itself"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('verified', 'Verified'),
+        ('rejected', 'Rejected'),
+        ('failed', 'Failed'),
+    )
+    
+    attendance = models.ForeignKey('employees.Attendance', on_delete=models.CASCADE, related_name='face_verification_jobs')
+    attendance_log = models.ForeignKey('employees.AttendanceLog', on_delete=models.SET_NULL, null=True, blank=True)
+    employee = models.ForeignKey('employees.EmployeeProfile', on_delete=models.CASCADE)
+    face_image = models.ImageField(upload_to=face_image_path)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    face_confidence = models.FloatField(blank=True, null=True)
+    message = models.CharField(max_length=255, blank=True, null=True)  # reason for rejected/failed
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'created_at'], name='face_verif_status_idx')]
+    
+    def __str__(self):
+        return f"Face verification {self.id} ({self.status}) for attendance {self.attendance_id}"
+
+
+class FaceEnrollmentJob(models.Model):
+    """A bulk enrollment ZIP waiting for (or done with) background encoding; the queue record itself"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    
+    company = models.ForeignKey('companies.Company', on_delete=models.CASCADE, related_name='face_enrollment_jobs')
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    archive = models.FileField(upload_to='face_enrollment/', blank=True, null=True)  # removed once processed
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    summary = models.JSONField(blank=True, null=True)  # {status: file count}
+    results = models.JSONField(blank=True, null=True)  # per-file report of bulk_enroll_from_zip
+    message = models.CharField(max_length=255, blank=True, null=True)  # reason for failed
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'created_at'], name='face_enroll_status_idx')]
+    
+    def __str__(self):
+        return f"Face enrollment {self.id} ({self.status}) for company {self.company_id}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Response of a POST sent with an Idempotency-Key header, replayed to retries of the
+    same request until expires_at (see employees.decorators.idempotent_request)
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    endpoint = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)  # SHA-256 of the body; a reused key with another body is refused
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # null while the first request runs
+    response_body = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        unique_together = ('user', 'endpoint', 'key')
+    
+    def __str__(self):
+        return f"{self.endpoint} {self.key} ({self.status_code or 'in progress'})"
+
         
 # employees/models.py (Add this to your existing file)
 
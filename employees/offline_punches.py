@@ -0,0 +1,381 @@
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .attendance_summary import refresh_daily_summaries
+from .face_utils import FaceQualityError, decode_base64_image, score_face_templates
+from .face_verification import encode_face_capture
+from .face_worker import FaceWorkerBusy
+from .geofence import DEFAULT_SITE_ID, employee_sites, get_employee_geofences_many
+from .models import Attendance, AttendanceLog, CompanyFaceSettings, EmployeeFaceData, EmployeeProfile, UserShift
+
+logger = logging.getLogger(__name__)
+
+
+class OfflinePunch:
+    """One punch captured by the app without connectivity, as uploaded in a batch"""
+
+    def __init__(self, index, client_id, employee, timestamp, latitude, longitude, face,
+                 location_id=None, device_info=None, blink_detected=False):
+        self.index = index
+        self.client_id = client_id
+        self.employee = employee
+        self.timestamp = timestamp  # aware, in the current timezone
+        self.latitude = latitude
+        self.longitude = longitude
+        self.face = face
+        self.location_id = location_id
+        self.device_info = device_info or {}
+        self.blink_detected = blink_detected
+        self.face_confidence = None
+        self.is_location_verified = False
+        self.location_name = None
+        self.location_distance = None
+        self.attendance = None
+        self.result = None  # set once the punch is rejected or written
+
+    def reject(self, status, message):
+        self.result = {'status': status, 'message': message}
+
+
+def _invalid(index, client_id, message):
+    return {'index': index, 'client_id': client_id, 'status': 'invalid', 'message': message}
+
+
+def _resolve_employees(user, raw_punches):
+    """
+    Employees the batch may punch for: the uploader's own profile, and for company admins
+    (shared kiosk devices) any employee of their company named by `employee_id`.
+    """
+    requested = {
+        raw.get('employee_id') for raw in raw_punches
+        if isinstance(raw, dict) and raw.get('employee_id') not in (None, '')
+    }
+    queryset = EmployeeProfile.objects.select_related('company', 'face_data', 'user')
+    if requested and user.role in ('companyadmin', 'superadmin'):
+        scoped = queryset.filter(id__in=[i for i in requested if str(i).isdigit()])
+        if user.role != 'superadmin':
+            scoped = scoped.filter(company_id=user.company_id)
+        employees = {str(e.id): e for e in scoped}
+    else:
+        employees = {}
+    own = queryset.filter(user=user).first()
+    return employees, own
+
+
+def parse_offline_punches(user, raw_punches):
+    """Validate a batch; returns (punches, results of the entries that were refused outright)"""
+    now = timezone.now()
+    max_age = timedelta(days=getattr(settings, 'OFFLINE_PUNCH_MAX_AGE_DAYS', 7))
+    clock_skew = timedelta(seconds=getattr(settings, 'OFFLINE_PUNCH_CLOCK_SKEW', 300))
+    employees, own = _resolve_employees(user, raw_punches)
+
+    punches, refused = [], []
+    for index, raw in enumerate(raw_punches):
+        if not isinstance(raw, dict):
+            refused.append(_invalid(index, None, 'Punch must be an object'))
+            continue
+        client_id = raw.get('client_id')
+
+        employee_id = raw.get('employee_id')
+        employee = employees.get(str(employee_id)) if employee_id not in (None, '') else own
+        if employee is None:
+            refused.append(_invalid(index, client_id, 'Employee not found'))
+            continue
+
+        timestamp = parse_datetime(raw['timestamp']) if isinstance(raw.get('timestamp'), str) else None
+        if timestamp is None:
+            refused.append(_invalid(index, client_id, 'timestamp must be an ISO 8601 date-time'))
+            continue
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+        if timestamp > now + clock_skew:
+            refused.append(_invalid(index, client_id, 'timestamp is in the future'))
+            continue
+        if timestamp < now - max_age:
+            refused.append(_invalid(index, client_id, f"timestamp is older than {max_age.days} days"))
+            continue
+
+        try:
+            latitude = float(raw['latitude'])
+            longitude = float(raw['longitude'])
+        except (KeyError, TypeError, ValueError):
+            refused.append(_invalid(index, client_id, 'Location data is required'))
+            continue
+
+        face = decode_base64_image(raw.get('face_image'))
+        if face is None:
+            refused.append(_invalid(index, client_id, 'Invalid image data'))
+            continue
+
+        punches.append(OfflinePunch(
+            index, client_id, employee, timezone.localtime(timestamp), latitude, longitude, face,
+            location_id=raw.get('location_id'),
+            device_info=raw.get('device_info') if isinstance(raw.get('device_info'), dict) else {},
+            blink_detected=bool(raw.get('blink_detected', False)),
+        ))
+    return punches, refused
+
+
+def _check_faces(punches):
+    """Encode every capture concurrently through the face worker and score it against the employee's templates"""
+    face_settings = {}
+    templates = {}
+    for punch in punches:
+        employee = punch.employee
+        if employee.company_id not in face_settings:
+            face_settings[employee.company_id] = CompanyFaceSettings.for_company(employee.company_id)
+        if employee.id not in templates:
+            try:
+                face_data = employee.face_data
+            except EmployeeFaceData.DoesNotExist:
+                face_data = None
+            templates[employee.id] = face_data.get_template_matrix(employee.company_id) if face_data else None
+
+    pending = []
+    for punch in punches:
+        if templates[punch.employee.id] is None:
+            punch.reject('rejected', 'Face data not registered')
+        else:
+            pending.append(punch)
+
+    # Threads only wait on the face worker's process pool, whose admission control still applies
+    with ThreadPoolExecutor(max_workers=getattr(settings, 'FACE_WORKER_CONCURRENCY', 2)) as executor:
+        futures = [
+            (punch, executor.submit(
+                encode_face_capture, punch.face, punch.employee.company_id, face_settings[punch.employee.company_id]
+            ))
+            for punch in pending
+        ]
+        for punch, future in futures:
+            try:
+                _, face_encodings, _ = future.result()
+            except FaceWorkerBusy:
+                punch.reject('retry', 'Face worker busy, upload this punch again later')
+                continue
+            except FaceQualityError as e:
+                punch.reject('rejected', e.message)
+                continue
+            except OSError as e:
+                # PIL's UnidentifiedImageError and truncated-file errors: re-uploading won't help
+                logger.info(f"Offline punch {punch.index} has an unreadable image: {e}")
+                punch.reject('rejected', 'Face image could not be read')
+                continue
+            except Exception:
+                logger.exception(f"Error verifying offline punch {punch.index}")
+                punch.reject('retry', 'Face verification error, upload this punch again later')
+                continue
+            if not face_encodings:
+                punch.reject('rejected', 'No face detected in the image')
+                continue
+            is_match, punch.face_confidence, _, _ = score_face_templates(
+                templates[punch.employee.id], face_encodings[0]
+            )
+            if not is_match:
+                punch.reject('rejected', 'Face does not match the registered face')
+
+
+def _check_locations(punches):
+    """Same rules as mark_attendance: the selected site first, then the nearest site containing the fix"""
+    geofences = get_employee_geofences_many({punch.employee.id for punch in punches})
+    sites = {employee_id: employee_sites(entry) for employee_id, entry in geofences.items()}
+    for punch in punches:
+        geofence = sites[punch.employee.id].check(punch.latitude, punch.longitude)
+        location_id = punch.location_id
+        if location_id == 'default' or not location_id:
+            selected = geofence.distance_to(DEFAULT_SITE_ID)
+            name = 'Default Location'
+        elif str(location_id).isdigit():
+            selected = geofence.distance_to(int(location_id))
+            name = geofence.sites.names[geofence.sites.index_of(int(location_id))] if selected else None
+        else:
+            selected, name = None, None
+        if selected is not None:
+            punch.location_distance, punch.is_location_verified = selected
+            if punch.is_location_verified:
+                punch.location_name = name
+        if not punch.is_location_verified:
+            nearest = geofence.nearest_match
+            if nearest is not None:
+                index, punch.location_distance = nearest
+                punch.is_location_verified = True
+                punch.location_name = geofence.sites.names[index]
+            elif punch.location_distance is None:
+                punch.location_distance = geofence.min_distance
+
+
+def _log(attendance, punch, message):
+    return AttendanceLog(
+        attendance=attendance,
+        employee=punch.employee,
+        company_id=punch.employee.company_id,
+        timestamp=punch.timestamp,
+        latitude=punch.latitude,
+        longitude=punch.longitude,
+        face_verification_result=True,
+        face_confidence=punch.face_confidence,
+        location_verification_result=punch.is_location_verified,
+        blink_verification_result=punch.blink_detected,
+        device_info=punch.device_info,
+        log_message=message,
+    )
+
+
+def _write_punches(punches):
+    """
+    Replay accepted punches in device-time order per employee against today's state of the
+    database, then write everything in one transaction: one bulk insert of new records, one
+    bulk update of closed ones, one bulk insert of logs.
+    """
+    from .views import resolve_attendance_shift
+
+    employee_ids = {punch.employee.id for punch in punches}
+    dates = {punch.timestamp.date() for punch in punches}
+    user_shifts = {}
+    for user_shift in UserShift.objects.filter(
+        user_id__in={punch.employee.user_id for punch in punches},
+        is_active=True,
+        start_date__lte=max(dates),
+        end_date__gte=min(dates),
+    ).select_related('shift'):
+        user_shifts.setdefault(user_shift.user_id, []).append(user_shift)
+
+    uploaded_at = timezone.now()
+    with transaction.atomic():
+        # Same serialization as mark_attendance: online punches of these employees wait for the batch
+        list(EmployeeProfile.objects.select_for_update().filter(id__in=employee_ids).values_list('id', flat=True))
+        days = {}
+        for record in Attendance.objects.select_for_update(of=('self',)).select_related('shift').filter(
+            employee_id__in=employee_ids, date__in=dates
+        ).order_by():
+            days.setdefault((record.employee_id, record.date), []).append(record)
+
+        created, closed, logs = [], {}, []
+        for punch in sorted(punches, key=lambda p: (p.employee.id, p.timestamp, p.index)):
+            today = punch.timestamp.date()
+            day_records = days.setdefault((punch.employee.id, today), [])
+            recorded_times = [t for r in day_records for t in (r.check_in_time, r.check_out_time) if t]
+            if recorded_times and punch.timestamp <= max(recorded_times):
+                punch.reject('out_of_order', 'A later punch is already recorded for this day')
+                continue
+
+            open_records = [r for r in day_records if r.check_out_time is None]
+            if open_records:
+                attendance = max(open_records, key=lambda r: r.check_in_time or punch.timestamp)
+                attendance.check_out_time = punch.timestamp
+                attendance.check_out_latitude = punch.latitude
+                attendance.check_out_longitude = punch.longitude
+                if punch.is_location_verified and punch.location_name:
+                    attendance.location_name = punch.location_name
+                attendance.is_location_verified = punch.is_location_verified
+                attendance.is_face_verified = True
+                attendance.face_confidence = punch.face_confidence
+                attendance.face_verification_status = 'verified'
+                attendance.is_blink_verified = punch.blink_detected
+                attendance.updated_at = uploaded_at
+                if attendance.pk:
+                    closed[attendance.pk] = attendance
+                message = "Offline attendance check-out recorded"
+                punch.result = {'status': 'checked_out'}
+            else:
+                day_shifts = [
+                    s for s in user_shifts.get(punch.employee.user_id, [])
+                    if s.start_date <= today <= s.end_date
+                ]
+                assigned_shift, shift_status, _ = resolve_attendance_shift(
+                    punch.employee.user, punch.employee, punch.timestamp,
+                    user_shifts=day_shifts, todays_attendance=day_records
+                )
+                attendance = Attendance(
+                    employee=punch.employee,
+                    company_id=punch.employee.company_id,
+                    shift=assigned_shift,
+                    date=today,
+                    check_in_time=punch.timestamp,
+                    check_in_latitude=punch.latitude,
+                    check_in_longitude=punch.longitude,
+                    status=shift_status,
+                    is_location_verified=punch.is_location_verified,
+                    is_face_verified=True,
+                    face_confidence=punch.face_confidence,
+                    face_verification_status='verified',
+                    is_blink_verified=punch.blink_detected,
+                    device_info=punch.device_info,
+                    face_image=punch.face.to_content_file(
+                        f"attendance_{punch.employee.id}_{uuid.uuid4()}.{punch.face.ext}"
+                    ),
+                    location_name=punch.location_name if punch.is_location_verified else None,
+                )
+                day_records.append(attendance)
+                created.append(attendance)
+                message = "Offline attendance check-in recorded"
+                if assigned_shift:
+                    message += f" for shift: {assigned_shift.name}"
+                punch.result = {'status': 'checked_in'}
+
+            if punch.location_name:
+                message += f" at {punch.location_name}"
+            punch.attendance = attendance
+            logs.append((attendance, punch, f"{message} (captured offline)"))
+
+        Attendance.objects.bulk_create(created, batch_size=100)
+        if created and not connection.features.can_return_rows_from_bulk_insert:
+            # Oracle does not return ids from a bulk insert; (employee, check-in time) identifies each new row
+            new_ids = {
+                (employee_id, check_in_time): pk
+                for pk, employee_id, check_in_time in Attendance.objects.filter(
+                    employee_id__in=employee_ids,
+                    check_in_time__in=[record.check_in_time for record in created],
+                ).values_list('id', 'employee_id', 'check_in_time')
+            }
+            for record in created:
+                record.pk = record.id = new_ids.get((record.employee_id, record.check_in_time))
+
+        if closed:
+            Attendance.objects.bulk_update(
+                list(closed.values()),
+                ['check_out_time', 'check_out_latitude', 'check_out_longitude', 'location_name',
+                 'is_location_verified', 'is_face_verified', 'face_confidence', 'face_verification_status',
+                 'is_blink_verified', 'updated_at'],
+                batch_size=100
+            )
+        AttendanceLog.objects.bulk_create(
+            [_log(attendance, punch, message) for attendance, punch, message in logs], batch_size=100
+        )
+        refresh_daily_summaries(days, [record for day in days.values() for record in day])
+
+
+def process_offline_punches(user, raw_punches):
+    """
+    Validate, verify and record a batch of offline punches.
+    Returns one result per submitted punch, in submission order.
+    """
+    punches, results = parse_offline_punches(user, raw_punches)
+    if punches:
+        _check_faces(punches)
+        accepted = [punch for punch in punches if punch.result is None]
+        if accepted:
+            _check_locations(accepted)
+            _write_punches(accepted)
+
+    for punch in punches:
+        attendance = punch.attendance if punch.result['status'] in ('checked_in', 'checked_out') else None
+        results.append({
+            'index': punch.index,
+            'client_id': punch.client_id,
+            'employee_id': punch.employee.id,
+            'timestamp': punch.timestamp.isoformat(),
+            **punch.result,
+            'attendance_id': attendance.id if attendance else None,
+            'is_location_verified': punch.is_location_verified,
+            'location_name': punch.location_name,
+            'location_distance': punch.location_distance,
+            'face_confidence': punch.face_confidence,
+        })
+    return sorted(results, key=lambda result: result['index'])
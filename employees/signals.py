@@ -0,0 +1,31 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .geofence import invalidate_company_geofence, invalidate_employee_geofences
+from .models import EmployeeFaceData, EmployeeLocation, EmployeeProfile
+
+
+def _company_of(employee_id):
+    return EmployeeProfile.objects.filter(id=employee_id).values_list('company_id', flat=True).first()
+
+
+@receiver(post_save, sender=EmployeeLocation)
+@receiver(post_delete, sender=EmployeeLocation)
+def employee_location_changed(sender, instance, **kwargs):
+    """Drop cached geofences after a location is created, edited or removed"""
+    invalidate_employee_geofences(instance.employee_id)
+    company_id = _company_of(instance.employee_id)
+    if company_id:
+        invalidate_company_geofence(company_id)
+
+
+@receiver(post_save, sender=EmployeeFaceData)
+@receiver(post_delete, sender=EmployeeFaceData)
+def face_data_changed(sender, instance, update_fields=None, **kwargs):
+    """Default coordinates live on EmployeeFaceData; encoding-only saves do not touch the grid"""
+    if update_fields and not {'default_latitude', 'default_longitude', 'allowed_radius'} & set(update_fields):
+        return
+    invalidate_employee_geofences(instance.employee_id)
+    company_id = _company_of(instance.employee_id)
+    if company_id:
+        invalidate_company_geofence(company_id)
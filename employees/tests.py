@@ -1,3 +1,101 @@
-from django.test import TestCase
+import base64
+import tempfile
+from datetime import date
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from companies.models import Company
+from users.models import User
+from .face_utils import ENCODING_DTYPE, ENCODING_SIZE, encoding_cache, template_cache
+from .models import Attendance, AttendanceDailySummary, AttendanceLog, EmployeeFaceData, EmployeeLocation, EmployeeProfile
+from .views import MARK_ATTENDANCE_QUERY_BUDGET
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), FACE_ASYNC_VERIFICATION=False, FACE_STORE_ENABLED=False)
+class MarkAttendanceQueryBudgetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        encoding_cache.clear()
+        template_cache.clear()
+        self.company = Company.objects.create(name='Budget Co', user_limit=10)
+        self.user = User.objects.create_user(
+            username='budget.employee', password='x', company=self.company, app_running=True
+        )
+        self.employee = EmployeeProfile.objects.create(
+            user=self.user, company=self.company, full_name='Budget Employee', date_of_joining=date(2024, 1, 1)
+        )
+        self.encoding = np.random.default_rng(7).random(ENCODING_SIZE).astype(ENCODING_DTYPE)
+        face_data = EmployeeFaceData(
+            employee=self.employee, default_latitude=28.6139, default_longitude=77.2090, allowed_radius=100
+        )
+        face_data.set_encoding(self.encoding)
+        face_data.save()
+        for i in range(5):
+            EmployeeLocation.objects.create(
+                employee=self.employee, location_name=f'Site {i}',
+                latitude=28.6139 + i * 0.01, longitude=77.2090, allowed_radius=150
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def punch(self, **extra):
+        payload = {
+            'face_image': 'data:image/png;base64,' + base64.b64encode(b'not decoded in this test').decode(),
+            'latitude': 28.6140,
+            'longitude': 77.2091,
+            **extra,
+        }
+        encoded = ([(0, 10, 10, 0)], [self.encoding], {})
+        with mock.patch('employees.views.encode_face_capture', return_value=encoded):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('mark_attendance'), payload, format='json')
+        return response, queries
+
+    def assertWithinBudget(self, queries):
+        self.assertLessEqual(
+            len(queries), MARK_ATTENDANCE_QUERY_BUDGET,
+            '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+
+    def test_check_in_and_check_out_stay_within_budget(self):
+        response, queries = self.punch()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(response.json()['data']['is_check_in'])
+        self.assertWithinBudget(queries)
+
+        response, queries = self.punch()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(response.json()['data']['is_checked_out'])
+        self.assertWithinBudget(queries)
+
+        self.assertEqual(Attendance.objects.filter(employee=self.employee).count(), 1)
+        self.assertEqual(AttendanceLog.objects.filter(employee=self.employee).count(), 2)
+        summary = AttendanceDailySummary.objects.get(employee=self.employee)
+        self.assertEqual((summary.record_count, summary.punch_count, summary.open_sessions), (1, 2, 0))
+
+    def test_forced_new_record_stays_within_budget(self):
+        self.punch()
+        response, queries = self.punch(force_new_record=True)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(response.json()['data']['previous_attendance_closed'])
+        self.assertWithinBudget(queries)
+        self.assertEqual(Attendance.objects.filter(employee=self.employee, check_out_time__isnull=True).count(), 1)
+
+    def test_forced_new_record_query_count(self):
+        self.punch()
+        response, queries = self.punch(force_new_record=True)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(len(queries), 13, '\n'.join(query['sql'] for query in queries.captured_queries))
+
+        closed = Attendance.objects.get(employee=self.employee, check_out_time__isnull=False)
+        self.assertTrue(closed.logs.filter(log_message__startswith='Automatic check-out').exists())
+        summary = AttendanceDailySummary.objects.get(employee=self.employee)
+        self.assertEqual((summary.record_count, summary.open_sessions), (2, 1))
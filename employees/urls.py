@@ -36,20 +36,36 @@ urlpatterns = [
     
     # Register face data
     path('register-face/', register_face_data, name='register_face_data'),
+    path('register-face/bulk/', bulk_face_enrollment, name='bulk_face_enrollment'),
+    path('register-face/bulk/<int:job_id>/', bulk_face_enrollment_status, name='bulk_face_enrollment_status'),
     path('check-face-data/', check_face_data, name='check_face_data'),
     path('get-face-image/', get_face_image, name='get_face_image'),
     # Add to urlpatterns
     path('compare-faces/', compare_faces, name='compare_faces'),
+    # Extra enrollment templates (primary registration stays as is)
+    path('face-templates/', manage_face_templates, name='face_templates'),
+    path('face-templates/<int:template_id>/', delete_face_template, name='delete_face_template'),
+    # Shared kiosk check-in (1:N identification)
+    path('kiosk/check-in/', kiosk_check_in, name='kiosk_check_in'),
+    # Readiness probe: 503 until the face models are warm (FACE_PRELOAD_MODELS)
+    path('face/ready/', face_readiness, name='face_readiness'),
+    # Worker and capture cache counters of the answering process (superadmin)
+    path('face/stats/', face_stats, name='face_stats'),
     # Mark attendance
     path('mark/', mark_attendance, name='mark_attendance'),
+    path('mark/offline-batch/', upload_offline_punches, name='upload_offline_punches'),
+    # Status of a deferred face check (async verification mode)
+    path('face-verification/<int:job_id>/', face_verification_status, name='face_verification_status'),
     
     # Get attendance history
     path('history/', attendance_history, name='attendance_history'),
+    path('summary/', attendance_summary_report, name='attendance_summary_report'),
     
     # Get last attendance record
     path('last/', last_attendance, name='last_attendance'),
     path('locations/', manage_employee_locations, name='employee-locations'),
     path('locations/<int:location_id>/', manage_employee_location_detail, name='employee-location-detail'),
+    path('locations/bulk-assign/', bulk_assign_employee_location, name='employee-location-bulk-assign'),
     path('my-allowed-locations/', get_my_allowed_locations, name='my-allowed-locations'),
     
 
@@ -197,6 +197,22 @@ DATABASES = {
     }
 }
 
+# Cache
+# Point this at a cache shared by all workers (e.g. CACHE_BACKEND=django.core.cache.backends.redis.RedisCache,
+# CACHE_LOCATION=redis://127.0.0.1:6379/1). The LocMemCache default is per process, so an invalidation
+# only reaches the worker that made it; caches with long TTLs shorten them when CACHE_IS_SHARED is False.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+CACHE_IS_SHARED = CACHE_BACKEND not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
    
 
 
@@ -247,4 +263,74 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
\ No newline at end of file
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+# Face recognition
+# Decoded face encodings kept in memory per worker process (LRU, keyed by employee)
+FACE_ENCODING_CACHE_SIZE = int(os.getenv('FACE_ENCODING_CACHE_SIZE', 1024))
+# Results of identical uploads (SHA-256 of the image bytes), so client retries skip dlib
+FACE_CAPTURE_CACHE_SIZE = int(os.getenv('FACE_CAPTURE_CACHE_SIZE', 256))
+FACE_CAPTURE_CACHE_TTL = int(os.getenv('FACE_CAPTURE_CACHE_TTL', 120))  # seconds, 0 disables
+# Company encodings in memory-mapped files shared by all workers of a host (kiosk + 1:1 lookups)
+FACE_STORE_ENABLED = os.getenv('FACE_STORE_ENABLED', 'False') == 'True'
+FACE_STORE_DIR = os.getenv('FACE_STORE_DIR', str(BASE_DIR / 'var' / 'face_store'))
+
+# dlib detection/encoding runs outside the request thread.
+# Use 'employees.face_worker.InlineFaceWorker' as a local stand-in (no subprocesses).
+FACE_WORKER_BACKEND = os.getenv('FACE_WORKER_BACKEND', 'employees.face_worker.ProcessPoolFaceWorker')
+FACE_WORKER_CONCURRENCY = int(os.getenv('FACE_WORKER_CONCURRENCY', 2))
+FACE_WORKER_QUEUE_DEPTH = int(os.getenv('FACE_WORKER_QUEUE_DEPTH', 8))  # waiting jobs before 503
+FACE_WORKER_TIMEOUT = int(os.getenv('FACE_WORKER_TIMEOUT', 30))  # seconds
+FACE_WORKER_RETRY_AFTER = int(os.getenv('FACE_WORKER_RETRY_AFTER', 2))  # seconds, sent as Retry-After
+# Load the dlib models when a worker boots (one dummy encode); /api/employees/face/ready/ reports the state
+FACE_PRELOAD_MODELS = os.getenv('FACE_PRELOAD_MODELS', 'False') == 'True'
+
+# Face pipeline defaults, overridable per company via CompanyFaceSettings
+FACE_DETECTION_MODEL = os.getenv('FACE_DETECTION_MODEL', 'hog')  # 'hog' or 'cnn'
+FACE_DETECTION_UPSAMPLE = int(os.getenv('FACE_DETECTION_UPSAMPLE', 1))
+FACE_NUM_JITTERS = int(os.getenv('FACE_NUM_JITTERS', 1))
+FACE_DETECTION_MAX_EDGE = int(os.getenv('FACE_DETECTION_MAX_EDGE', 640))  # px, 0 = detect at full size
+FACE_MAX_TEMPLATES = int(os.getenv('FACE_MAX_TEMPLATES', 5))  # extra enrollment templates per employee
+# Image quality gate (blur/brightness/face size) before dlib; off unless a company opts in
+FACE_QUALITY_CHECK_ENABLED = os.getenv('FACE_QUALITY_CHECK_ENABLED', 'False') == 'True'
+FACE_MIN_FACE_SIZE = int(os.getenv('FACE_MIN_FACE_SIZE', 0))  # px, 0 = no minimum
+# Async verification mode (per company via CompanyFaceSettings.async_verification): punches are
+# recorded after the geofence/shift checks and the face is checked by `manage.py process_face_verifications`.
+# 'employees.face_verification.ThreadVerificationQueue' is a local stand-in that verifies in-process.
+FACE_ASYNC_VERIFICATION = os.getenv('FACE_ASYNC_VERIFICATION', 'False') == 'True'
+FACE_VERIFICATION_QUEUE = os.getenv('FACE_VERIFICATION_QUEUE', 'employees.face_verification.DatabaseVerificationQueue')
+FACE_VERIFICATION_MAX_ATTEMPTS = int(os.getenv('FACE_VERIFICATION_MAX_ATTEMPTS', 3))
+# Bulk enrollment ZIPs are encoded in the background (FaceEnrollmentJob). The default queue runs them one at
+# a time per web process on a shared pool of FACE_ENROLLMENT_WORKERS processes; with
+# 'employees.face_enrollment.DatabaseEnrollmentQueue' they wait for `manage.py process_face_enrollments`.
+FACE_ENROLLMENT_QUEUE = os.getenv('FACE_ENROLLMENT_QUEUE', 'employees.face_enrollment.ThreadEnrollmentQueue')
+FACE_ENROLLMENT_WORKERS = int(os.getenv('FACE_ENROLLMENT_WORKERS', 2))
+# Bump when the embedding model/library or encode parameters change, then run `manage.py reencode_faces`
+FACE_ENCODING_VERSION = os.getenv('FACE_ENCODING_VERSION', '1')
+# Older versions whose vectors stay comparable with the current one (comma separated); rows of
+# other versions are not matched until `reencode_faces` has converted them
+FACE_ENCODING_COMPATIBLE_VERSIONS = [v for v in os.getenv('FACE_ENCODING_COMPATIBLE_VERSIONS', '').split(',') if v.strip()]
+
+# Geofencing
+# Per-company grid index over EmployeeLocation + default coordinates (cell size in meters)
+GEOFENCE_GRID_CELL_METERS = int(os.getenv('GEOFENCE_GRID_CELL_METERS', 500))
+GEOFENCE_GRID_TTL = int(os.getenv('GEOFENCE_GRID_TTL', 300))  # seconds before a worker rebuilds its grid anyway
+GEOFENCE_GRID_MIN_SITES = int(os.getenv('GEOFENCE_GRID_MIN_SITES', 64))  # employees with more sites use the grid
+# Per-employee allowed-location sets in the Django cache, invalidated by signals. Other workers
+# only see the invalidation through a shared cache, so a per-process cache keeps entries briefly
+GEOFENCE_CACHE_TTL = int(os.getenv('GEOFENCE_CACHE_TTL', 3600 if CACHE_IS_SHARED else 60))
+
+# Idempotency-Key support for retried POSTs (employees.decorators.idempotent_request)
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 86400))  # seconds a stored response is replayed
+IDEMPOTENCY_IN_PROGRESS_TIMEOUT = int(os.getenv('IDEMPOTENCY_IN_PROGRESS_TIMEOUT', 120))  # then a stuck key is reusable
+
+# Offline punch uploads (POST /api/employees/mark/offline-batch/)
+OFFLINE_PUNCH_MAX_BATCH = int(os.getenv('OFFLINE_PUNCH_MAX_BATCH', 50))
+# Request body cap for the batch endpoint (Django's 2.5 MB DATA_UPLOAD_MAX_MEMORY_SIZE is too small
+# for a batch of base64 selfies); sized at 512 KB per punch by default, larger bodies get a 413
+OFFLINE_PUNCH_MAX_BODY_SIZE = int(os.getenv('OFFLINE_PUNCH_MAX_BODY_SIZE', OFFLINE_PUNCH_MAX_BATCH * 512 * 1024))
+OFFLINE_PUNCH_MAX_AGE_DAYS = int(os.getenv('OFFLINE_PUNCH_MAX_AGE_DAYS', 7))  # older device timestamps are refused
+OFFLINE_PUNCH_CLOCK_SKEW = int(os.getenv('OFFLINE_PUNCH_CLOCK_SKEW', 300))  # seconds a device clock may run ahead
+
+# attendance_history keyset pagination
+ATTENDANCE_HISTORY_PAGE_SIZE = int(os.getenv('ATTENDANCE_HISTORY_PAGE_SIZE', 100))
+ATTENDANCE_HISTORY_MAX_PAGE_SIZE = int(os.getenv('ATTENDANCE_HISTORY_MAX_PAGE_SIZE', 500))
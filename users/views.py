@@ -255,6 +255,8 @@ def mark_app_inactive(request):
     
     # Import required models
     from employees.models import EmployeeProfile, Attendance, AttendanceLog
+    from employees.attendance_summary import refresh_daily_summaries
+    from django.db import transaction
     
     # Update user's app status to inactive
     user.app_running = False
@@ -270,37 +272,42 @@ def mark_app_inactive(request):
         employee = EmployeeProfile.objects.get(user=user)
         print(f"Found employee profile for: {employee}")
         
-        try:
-            attendance = Attendance.objects.get(
-                employee=employee, 
-                date=today,
-                check_out_time__isnull=True  # Only get records without checkout
-            )
-            print(f"Found open attendance record: {attendance.id}")
+        with transaction.atomic():
+            # Same employee row lock as mark_attendance, so this check-out and its summary
+            # refresh cannot interleave with a punch of the same employee
+            list(EmployeeProfile.objects.select_for_update().filter(id=employee.id).values_list('id', flat=True))
+            try:
+                attendance = Attendance.objects.select_for_update().get(
+                    employee=employee, 
+                    date=today,
+                    check_out_time__isnull=True  # Only get records without checkout
+                )
+                print(f"Found open attendance record: {attendance.id}")
             
-            # Record checkout time
-            attendance.check_out_time = timezone.now()
-            # If you're storing latitude/longitude for checkout, use default values
-            attendance.check_out_latitude = attendance.check_in_latitude if hasattr(attendance, 'check_in_latitude') else None
-            attendance.check_out_longitude = attendance.check_in_longitude if hasattr(attendance, 'check_in_longitude') else None
-            attendance.save()
-            print("Updated attendance with checkout time")
+                # Record checkout time
+                attendance.check_out_time = timezone.now()
+                # If you're storing latitude/longitude for checkout, use default values
+                attendance.check_out_latitude = attendance.check_in_latitude if hasattr(attendance, 'check_in_latitude') else None
+                attendance.check_out_longitude = attendance.check_in_longitude if hasattr(attendance, 'check_in_longitude') else None
+                attendance.save()
+                print("Updated attendance with checkout time")
+                refresh_daily_summaries({(employee.id, attendance.date)})
             
-            # Create attendance log for automatic checkout
-            log = AttendanceLog.objects.create(
-                attendance=attendance,
-                employee=employee,
-                company=employee.company,
-                latitude=attendance.check_in_latitude if hasattr(attendance, 'check_in_latitude') else None,
-                longitude=attendance.check_in_longitude if hasattr(attendance, 'check_in_longitude') else None,
-                face_verification_result=True,  # Assume verification OK for auto-checkout
-                location_verification_result=True,  # Assume verification OK for auto-checkout
-                device_info={"auto_logout": True, "app_closed": True},
-                log_message="Automatic check-out when monitoring app was closed"
-            )
-            print(f"Created attendance log: {log.id}")
-        except Attendance.DoesNotExist:
-            print("No open attendance record found")
+                # Create attendance log for automatic checkout
+                log = AttendanceLog.objects.create(
+                    attendance=attendance,
+                    employee=employee,
+                    company=employee.company,
+                    latitude=attendance.check_in_latitude if hasattr(attendance, 'check_in_latitude') else None,
+                    longitude=attendance.check_in_longitude if hasattr(attendance, 'check_in_longitude') else None,
+                    face_verification_result=True,  # Assume verification OK for auto-checkout
+                    location_verification_result=True,  # Assume verification OK for auto-checkout
+                    device_info={"auto_logout": True, "app_closed": True},
+                    log_message="Automatic check-out when monitoring app was closed"
+                )
+                print(f"Created attendance log: {log.id}")
+            except Attendance.DoesNotExist:
+                print("No open attendance record found")
     except EmployeeProfile.DoesNotExist:
         print("Employee profile not found")
     
@@ -352,6 +359,8 @@ def check_inactive_users():
         
         # Import required models
         from employees.models import EmployeeProfile, Attendance, AttendanceLog
+        from employees.attendance_summary import refresh_daily_summaries
+        from django.db import transaction
         
         # Update user's app status to inactive
         user.app_running = False
@@ -364,34 +373,39 @@ def check_inactive_users():
         try:
             employee = EmployeeProfile.objects.get(user=user)
             
-            try:
-                attendance = Attendance.objects.get(
-                    employee=employee, 
-                    date=today,
-                    check_out_time__isnull=True  # Only get records without checkout
-                )
+            with transaction.atomic():
+                # Same employee row lock as mark_attendance, so this check-out and its summary
+                # refresh cannot interleave with a punch of the same employee
+                list(EmployeeProfile.objects.select_for_update().filter(id=employee.id).values_list('id', flat=True))
+                try:
+                    attendance = Attendance.objects.select_for_update().get(
+                        employee=employee, 
+                        date=today,
+                        check_out_time__isnull=True  # Only get records without checkout
+                    )
                 
-                # Record checkout time
-                attendance.check_out_time = now
-                # If you're storing latitude/longitude for checkout, use default values
-                attendance.check_out_latitude = attendance.check_in_latitude if hasattr(attendance, 'check_in_latitude') else None
-                attendance.check_out_longitude = attendance.check_in_longitude if hasattr(attendance, 'check_in_longitude') else None
-                attendance.save()
+                    # Record checkout time
+                    attendance.check_out_time = now
+                    # If you're storing latitude/longitude for checkout, use default values
+                    attendance.check_out_latitude = attendance.check_in_latitude if hasattr(attendance, 'check_in_latitude') else None
+                    attendance.check_out_longitude = attendance.check_in_longitude if hasattr(attendance, 'check_in_longitude') else None
+                    attendance.save()
+                    refresh_daily_summaries({(employee.id, attendance.date)})
                 
-                # Create attendance log for automatic checkout
-                AttendanceLog.objects.create(
-                    attendance=attendance,
-                    employee=employee,
-                    company=employee.company,
-                    latitude=attendance.check_in_latitude if hasattr(attendance, 'check_in_latitude') else None,
-                    longitude=attendance.check_in_longitude if hasattr(attendance, 'check_in_longitude') else None,
-                    face_verification_result=True,  # Assume verification OK for auto-checkout
-                    location_verification_result=True,  # Assume verification OK for auto-checkout
-                    device_info={"auto_logout": True, "inactivity_timeout": True},
-                    log_message="Automatic check-out due to 3-minute inactivity timeout"
-                )
-            except Attendance.DoesNotExist:
-                print(f"No open attendance record found for user {user.username}")
+                    # Create attendance log for automatic checkout
+                    AttendanceLog.objects.create(
+                        attendance=attendance,
+                        employee=employee,
+                        company=employee.company,
+                        latitude=attendance.check_in_latitude if hasattr(attendance, 'check_in_latitude') else None,
+                        longitude=attendance.check_in_longitude if hasattr(attendance, 'check_in_longitude') else None,
+                        face_verification_result=True,  # Assume verification OK for auto-checkout
+                        location_verification_result=True,  # Assume verification OK for auto-checkout
+                        device_info={"auto_logout": True, "inactivity_timeout": True},
+                        log_message="Automatic check-out due to 3-minute inactivity timeout"
+                    )
+                except Attendance.DoesNotExist:
+                    print(f"No open attendance record found for user {user.username}")
         except EmployeeProfile.DoesNotExist:
             print(f"Employee profile not found for user {user.username}")
         